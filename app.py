@@ -1,16 +1,26 @@
 # ========== IMPORTS ==========
 import base64
 import streamlit as st
-from PIL import Image
 import sqlite3
 import random
 import string
 import time
 import smtplib
 from email.message import EmailMessage
-import io
-from inference_sdk import InferenceHTTPClient
+import zipfile
 import pandas as pd
+import bootstrap
+import database
+import inference_client
+import image_pipeline
+import image_store
+import result_cache
+import detection
+import duplicate_index
+import bulk_ingest
+import postprocess
+import rollups
+import user_stats
 
 import streamlit as st
 
@@ -104,11 +114,74 @@ def send_otp_email(receiver_email, otp):
         return False
 
 def init_client():
-    """Initialize Roboflow client for disease detection"""
-    return InferenceHTTPClient(
-        api_url="https://serverless.roboflow.com",
-        api_key="KajReyLpzYwgJ8fJ8sVd"
-    )
+    """Get the shared inference backend (Roboflow serverless or local engine) for disease detection"""
+    return inference_client.get_client()
+
+def show_detection_result(result, result_source=None, preprocess_report=None):
+    """Render the result cards for one detection"""
+    if preprocess_report and preprocess_report.get("tiled"):
+        width, height = preprocess_report["original_size"]
+        st.caption(f"High-resolution scan: full {width}×{height} photo checked in {result.get('tiles', 0)} tiles")
+    elif preprocess_report:
+        st.caption(f"Upload size: {preprocess_report['original_bytes'] / 1024:.0f} KB → "
+                   f"{preprocess_report['processed_bytes'] / 1024:.0f} KB")
+        if preprocess_report.get("roi"):
+            st.caption(f"Cropped to the leaf ({preprocess_report['roi_fraction'] * 100:.0f}% of the frame, "
+                       f"{preprocess_report['roi_bytes_saved'] / 1024:.0f} KB saved)")
+    if result_source == "duplicate":
+        st.caption("This leaf looks the same as one of your earlier scans, so that result was reused")
+    elif result_source in ("memory", "disk"):
+        st.caption("Result reused from an earlier scan of this photo")
+    if preprocess_report and preprocess_report.get("quality"):
+        for warning in preprocess_report["quality"]["warnings"]:
+            st.warning(warning)
+
+    summary = postprocess.summarize(result)
+    if summary["diagnosis"] != "Healthy":
+        disease = summary["diagnosis"]
+        confidence = summary["confidence"]
+        top_class = summary["classes"][0]
+        other_classes = "".join(
+            f"<div>{c['class']}: {c['count']} spot(s), up to {c['max_confidence']:.1f}%</div>"
+            for c in summary["classes"][1:]
+        )
+
+        st.markdown(f"""
+        <div class='result-box disease-result'>
+            <h2 style="margin: 0 0 15px 0; color: #2e7d32;">Detection Result</h2>
+            <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 15px;">
+                <span style="font-weight: bold; color: #d32f2f; font-size: 28px;">{disease}</span>
+                <span style="font-weight: bold; color: #2e7d32; font-size: 24px;">{confidence:.1f}%</span>
+            </div>
+            <div class="confidence-bar">
+                <div class="confidence-fill" style="width: {confidence}%;"></div>
+            </div>
+            <div style="color: #6c757d; font-size: 14px;">
+                {top_class['count']} affected spot(s), average confidence {top_class['mean_confidence']:.1f}%
+                {f"<div style='margin-top: 8px;'><strong>Also found:</strong>{other_classes}</div>" if other_classes else ""}
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        st.markdown("""
+        <div class='result-box'>
+            <h2 style="margin: 0 0 15px 0; color: #2e7d32;">Detection Result</h2>
+            <div style="text-align: center; padding: 20px;">
+                <img src="https://cdn-icons-png.flaticon.com/128/5610/5610944.png" width="60">
+                <h2 style="color: #2e7d32; font-size: 28px; margin: 15px 0;">Healthy Rice Plant</h2>
+                <p style="font-size: 16px;">No diseases detected</p>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+
+@st.fragment(run_every=1)
+def poll_detection_job(job_id):
+    """Poll a background detection job without rerunning the whole page"""
+    job = detection.get_job(job_id)
+    if job and job["status"] in ("queued", "running"):
+        st.info("Analyzing image... You can keep using the app while we check your palay.")
+    else:
+        st.rerun()
 
 def show_bottom_nav(active_page):
     """Display bottom navigation bar"""
@@ -147,42 +220,9 @@ def show_bottom_nav(active_page):
     
     st.markdown('</div>', unsafe_allow_html=True)
 
-# ========== DATABASE SETUP ==========
-conn = sqlite3.connect("users.db")
-cursor = conn.cursor()
-
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE,
-        email TEXT,
-        phone TEXT,
-        password TEXT,
-        user_type TEXT DEFAULT 'farmer'
-    )
-''')
-
-# Add user_type column if it doesn't exist (for existing databases)
-try:
-    cursor.execute("ALTER TABLE users ADD COLUMN user_type TEXT DEFAULT 'farmer'")
-    conn.commit()
-    print("Added user_type column to existing database")
-except sqlite3.OperationalError:
-    # Column already exists
-    pass
-
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        result TEXT,
-        confidence REAL,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-''')
-conn.commit()
-conn.close()
+# ========== STARTUP ==========
+# Migrations, the logo and shared clients are set up once per server process, not per rerun
+resources = bootstrap.get_resources()
 
 # ========== SESSION STATE INITIALIZATION ==========
 if "user_id" not in st.session_state:
@@ -197,6 +237,11 @@ if "user_type" not in st.session_state:
 if "page" not in st.session_state:
     st.session_state.page = "login"
 
+# History rows (each with an inline thumbnail) shown at first and added per "Show more"
+HISTORY_PAGE_SIZE = 20
+if "history_limit" not in st.session_state:
+    st.session_state.history_limit = HISTORY_PAGE_SIZE
+
 # Handle bottom nav clicks
 query_params = st.query_params
 if 'nav' in query_params:
@@ -361,10 +406,7 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ========== LOAD LOGO ==========
-try:
-    logo = Image.open("ver 2.0 logo.png")
-except:
-    logo = None
+logo = resources["logo"]
 
 # ========== SHARED HEADER ==========
 def show_header():
@@ -415,7 +457,7 @@ if st.session_state.page == "login":
     # Login Button
     if st.button("LOG IN", key="login_button", use_container_width=True):
         if username and password:
-            conn = sqlite3.connect("users.db")
+            conn = database.connect()
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT id, username, user_type FROM users WHERE username = ? AND password = ? AND user_type = ?", 
@@ -478,7 +520,7 @@ elif st.session_state.page == "signup":
             st.error("Passwords do not match")
         else:
             try:
-                conn = sqlite3.connect("users.db")
+                conn = database.connect()
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO users (username, email, phone, password, user_type)
@@ -520,20 +562,20 @@ elif st.session_state.page == "admin_dashboard":
     
     col1, col2, col3 = st.columns(3)
     
-    conn = sqlite3.connect("users.db")
+    conn = database.connect()
     cursor = conn.cursor()
     
-    cursor.execute("SELECT COUNT(*) FROM users WHERE user_type = 'farmer'")
-    total_farmers = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM users WHERE user_type = 'admin'")
-    total_admins = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM history")
-    total_detections = cursor.fetchone()[0]
+    cursor.execute("SELECT user_type, COUNT(*) FROM users GROUP BY user_type")
+    user_counts = dict(cursor.fetchall())
+    total_farmers = user_counts.get("farmer", 0)
+    total_admins = user_counts.get("admin", 0)
     
     conn.close()
     
+    # Detection counters come from the daily rollup, not a scan of history
+    detection_summary = rollups.summary()
+    total_detections = detection_summary["total"]
+    
     with col1:
         st.markdown(f"""
             <div class="metric-card">
@@ -561,6 +603,25 @@ elif st.session_state.page == "admin_dashboard":
             </div>
         """, unsafe_allow_html=True)
     
+    st.markdown("<br>", unsafe_allow_html=True)
+    
+    act1, act2, act3 = st.columns(3)
+    with act1:
+        st.metric("Today's Detections", detection_summary["today"])
+    with act2:
+        st.metric("Last 7 Days", detection_summary["week"])
+    with act3:
+        st.metric("Last 30 Days", detection_summary["month"])
+    
+    if detection_summary["week_diseases"]:
+        st.caption("This week: " + " | ".join(
+            f"{row['disease']}: {row['count']}" for row in detection_summary["week_diseases"]
+        ))
+    if detection_summary["week_by_user_type"]:
+        st.caption("By account type: " + " | ".join(
+            f"{user_type.title()}: {count}" for user_type, count in detection_summary["week_by_user_type"].items()
+        ))
+    
     st.markdown("---")
     
     st.markdown("""
@@ -572,31 +633,240 @@ elif st.session_state.page == "admin_dashboard":
     
     st.markdown("<br>", unsafe_allow_html=True)
     
-    tab1, tab2, tab3 = st.tabs(["Users", "Detection History", "Settings"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Users", "Detection History", "Settings", "Bulk Ingest"])
     
     with tab1:
         st.write("**Registered Users**")
-        conn = sqlite3.connect("users.db")
+        conn = database.connect()
         users_df = pd.read_sql_query("SELECT id, username, email, user_type FROM users", conn)
         conn.close()
         st.dataframe(users_df, use_container_width=True)
     
     with tab2:
         st.write("**Recent Detection History**")
-        conn = sqlite3.connect("users.db")
+        conn = database.connect()
         history_df = pd.read_sql_query("""
-            SELECT h.id, u.username, h.result, h.confidence, h.created_at 
+            SELECT h.id, h.image_hash, u.username, h.result, h.confidence,
+                   h.duplicate_of IS NOT NULL AS repeat_scan, h.created_at 
             FROM history h 
             JOIN users u ON h.user_id = u.id 
             ORDER BY h.created_at DESC 
             LIMIT 50
         """, conn)
         conn.close()
-        st.dataframe(history_df, use_container_width=True)
+        # Thumbnails were made when the scan was stored, so this never decodes the originals
+        history_df["image_hash"] = history_df["image_hash"].map(image_store.get_store().thumbnail_data_uri)
+        st.dataframe(
+            history_df,
+            use_container_width=True,
+            column_config={
+                "image_hash": st.column_config.ImageColumn("Photo"),
+                "repeat_scan": st.column_config.CheckboxColumn("Repeat Scan"),
+            }
+        )
     
     with tab3:
         st.write("**System Settings**")
         st.info("Settings panel coming soon...")
+
+        pool_stats = init_client().stats()
+        if pool_stats["backend"] == "local":
+            st.markdown("#### Local Inference Engine")
+            col_pool1, col_pool2, col_pool3 = st.columns(3)
+            with col_pool1:
+                st.metric("Inference Calls", pool_stats["calls"])
+            with col_pool2:
+                st.metric("Average Latency", f"{pool_stats['avg_ms']:.0f} ms")
+            with col_pool3:
+                st.metric("CPU Threads", pool_stats["threads"])
+        else:
+            st.markdown("#### Inference Connection Pool")
+            col_pool1, col_pool2, col_pool3, col_pool4 = st.columns(4)
+            with col_pool1:
+                st.metric("Inference Calls", pool_stats["calls"])
+            with col_pool2:
+                st.metric("Connections Opened", pool_stats["connections_opened"])
+            with col_pool3:
+                st.metric("Connections Reused", pool_stats["connections_reused"])
+            with col_pool4:
+                st.metric("Reuse Ratio", f"{pool_stats['reuse_ratio'] * 100:.0f}%")
+            st.caption(f"Pool size: {pool_stats['pool_size']} | Keep-alive: {pool_stats['keep_alive']}s | Idle resets: {pool_stats['idle_resets']}")
+
+        st.markdown("#### Inference Circuit Breaker")
+        breaker_stats = pool_stats["breaker"]
+        resilience_stats = pool_stats["resilience"]
+        col_breaker1, col_breaker2, col_breaker3, col_breaker4 = st.columns(4)
+        with col_breaker1:
+            st.metric("Breaker State", breaker_stats["state"].replace("_", " ").title())
+        with col_breaker2:
+            st.metric("Recent Error Rate", f"{breaker_stats['window_error_rate'] * 100:.0f}%")
+        with col_breaker3:
+            st.metric("Retries", resilience_stats["retries"])
+        with col_breaker4:
+            st.metric("Failed Fast", resilience_stats["short_circuited"])
+        st.caption(f"Times opened: {breaker_stats['times_opened']} | Upstream failures: {resilience_stats['failures']} | "
+                   f"Deadline exceeded: {resilience_stats['deadline_exceeded']} | "
+                   f"Fallback: {pool_stats['fallback'] or 'none'} ({resilience_stats['fallbacks']} used)")
+
+        st.markdown("#### Image Quality Gate")
+        gate_stats = image_pipeline.quality_gate_stats()
+        col_gate1, col_gate2, col_gate3, col_gate4 = st.columns(4)
+        with col_gate1:
+            st.metric("Photos Checked", gate_stats["checked"])
+        with col_gate2:
+            st.metric("Rejected (Calls Saved)", gate_stats["rejected"])
+        with col_gate3:
+            st.metric("Warned", gate_stats["warned"])
+        with col_gate4:
+            st.metric("Gate Latency", f"{gate_stats['avg_ms']:.1f} ms")
+        if gate_stats["reasons"]:
+            st.caption("Rejections: " + " | ".join(f"{reason}: {count}" for reason, count in gate_stats["reasons"].items()))
+
+        st.markdown("#### Leaf Cropping")
+        crop_stats = image_pipeline.leaf_crop_stats()
+        col_crop1, col_crop2, col_crop3, col_crop4 = st.columns(4)
+        with col_crop1:
+            st.metric("Photos Prepared", crop_stats["scans"])
+        with col_crop2:
+            st.metric("Cropped to Leaf", crop_stats["cropped"])
+        with col_crop3:
+            st.metric("Upload Saved", f"{crop_stats['bytes_saved'] / 1024:.0f} KB")
+        with col_crop4:
+            st.metric("Crop Latency", f"{crop_stats['avg_ms']:.1f} ms")
+
+        st.markdown("#### Scan Image Store")
+        store_stats = image_store.get_store().stats()
+        col_store1, col_store2, col_store3 = st.columns(3)
+        with col_store1:
+            st.metric("New Images", store_stats["writes"])
+        with col_store2:
+            st.metric("Written", f"{store_stats['bytes_written'] / (1024 * 1024):.1f} MB")
+        with col_store3:
+            st.metric("Duplicates Skipped", store_stats["duplicates"])
+        # Walking the store grows with every scan, so it only runs when asked for
+        if st.button("Measure disk usage", key="store_disk_usage_btn"):
+            usage = image_store.get_store().disk_usage()
+            st.caption(f"{usage['images']} stored images, {usage['disk_bytes'] / (1024 * 1024):.1f} MB on disk")
+
+        st.markdown("#### Near-Duplicate Index")
+        dedup_stats = duplicate_index.get_index().stats()
+        col_dedup1, col_dedup2, col_dedup3, col_dedup4 = st.columns(4)
+        with col_dedup1:
+            st.metric("Indexed Scans", dedup_stats["indexed"] if dedup_stats["indexed"] is not None else "Not loaded")
+        with col_dedup2:
+            st.metric("Lookups", dedup_stats["lookups"])
+        with col_dedup3:
+            st.metric("Repeat Scans Reused", dedup_stats["hits"])
+        with col_dedup4:
+            st.metric("Lookup Latency", f"{dedup_stats['avg_lookup_ms']:.2f} ms")
+        st.caption(f"{dedup_stats['rejected']} lookalike scan(s) were analysed again because the leaf's pixels differed")
+
+        st.markdown("#### Inference Result Cache")
+        cache_stats = result_cache.get_cache().stats()
+        col_cache1, col_cache2, col_cache3, col_cache4 = st.columns(4)
+        with col_cache1:
+            st.metric("Cache Hits", cache_stats["memory_hits"] + cache_stats["disk_hits"])
+        with col_cache2:
+            st.metric("Cache Misses", cache_stats["misses"])
+        with col_cache3:
+            st.metric("Evictions", cache_stats["memory_evictions"] + cache_stats["disk_evictions"])
+        with col_cache4:
+            st.metric("Hit Ratio", f"{cache_stats['hit_ratio'] * 100:.0f}%")
+        st.caption(f"Memory: {cache_stats['memory_entries']} entries ({cache_stats['memory_hits']} hits) | "
+                   f"Disk: {cache_stats['disk_entries']} entries, {cache_stats['disk_bytes'] / 1024:.1f} KB "
+                   f"({cache_stats['disk_hits']} hits) | Expired: {cache_stats['expired']}")
+
+        st.markdown("#### Startup")
+        startup_timings = resources["timings"]
+        st.caption(f"Server started {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(resources['started_at']))}, "
+                   f"startup took {resources['total_ms']:.0f} ms: "
+                   + " | ".join(f"{name.replace('_', ' ')} {ms:.0f} ms" for name, ms in startup_timings.items()))
+
+        st.markdown("#### Database")
+        db_stats = database.pool_stats()
+        col_db1, col_db2, col_db3, col_db4 = st.columns(4)
+        with col_db1:
+            st.metric("Connections Opened", db_stats["opened"])
+        with col_db2:
+            st.metric("Connections Reused", db_stats["reused"])
+        with col_db3:
+            st.metric("Idle in Pool", f"{db_stats['idle']} / {db_stats['size']}")
+        with col_db4:
+            st.metric("Discarded", db_stats["discarded"])
+        slowest_queries = database.query_stats()
+        if slowest_queries:
+            st.caption("Queries by total time")
+            st.dataframe(
+                pd.DataFrame(slowest_queries)[["statement", "calls", "avg_ms", "max_ms", "total_ms"]],
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "avg_ms": st.column_config.NumberColumn("avg ms", format="%.2f"),
+                    "max_ms": st.column_config.NumberColumn("max ms", format="%.2f"),
+                    "total_ms": st.column_config.NumberColumn("total ms", format="%.1f"),
+                }
+            )
+
+    with tab4:
+        st.write("**Bulk Ingest Survey Photos**")
+        st.caption("Upload a ZIP of survey photos. If a run is interrupted, upload the same ZIP again to resume it.")
+        survey_zip = st.file_uploader("Choose a ZIP archive", type=["zip"], key="ingest_upload")
+
+        if st.button("START INGEST", key="ingest_btn", use_container_width=True):
+            if survey_zip is None:
+                st.error("Please upload a ZIP archive first.")
+            else:
+                progress = st.progress(0.0, text="Reading archive...")
+
+                def show_ingest_progress(done, total, entry_name):
+                    progress.progress(done / total, text=f"Processed {done} of {total}: {entry_name}")
+
+                ingest_start = time.perf_counter()
+                try:
+                    st.session_state.ingest_run_id = bulk_ingest.ingest_archive(
+                        survey_zip, survey_zip.name, st.session_state.user_id, on_progress=show_ingest_progress
+                    )
+                except zipfile.BadZipFile:
+                    st.error("That file is not a valid ZIP archive.")
+                else:
+                    progress.progress(1.0, text="Ingest complete")
+                    st.caption(f"Finished in {time.perf_counter() - ingest_start:.1f}s")
+                    failed = sum(1 for item in bulk_ingest.run_results(st.session_state.ingest_run_id)
+                                 if item["status"] == "failed")
+                    if failed:
+                        st.warning(f"{failed} image(s) failed. Upload the same ZIP again to retry only those.")
+
+        ingest_runs = bulk_ingest.list_runs()
+        if ingest_runs:
+            st.markdown("#### Ingest Runs")
+            st.dataframe(pd.DataFrame(ingest_runs), use_container_width=True, hide_index=True)
+
+            run_ids = [run["id"] for run in ingest_runs]
+            selected_run = st.selectbox(
+                "Show results for run",
+                run_ids,
+                index=run_ids.index(st.session_state.ingest_run_id) if st.session_state.get("ingest_run_id") in run_ids else 0,
+                key="ingest_selected_run"
+            )
+            results_df = pd.DataFrame(bulk_ingest.run_results(selected_run))
+            if not results_df.empty:
+                results_df["image_hash"] = results_df["image_hash"].map(image_store.get_store().thumbnail_data_uri)
+                st.dataframe(
+                    results_df,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        "image_hash": st.column_config.ImageColumn("Photo"),
+                        "confidence": st.column_config.NumberColumn("confidence", format="%.1f%%"),
+                    }
+                )
+                st.download_button(
+                    "Download results (CSV)",
+                    results_df.drop(columns=["image_hash"]).to_csv(index=False),
+                    file_name=f"ingest_run_{selected_run}.csv",
+                    mime="text/csv",
+                    key="ingest_download"
+                )
     
     if st.button("Logout", key="admin_logout"):
         st.session_state.user_id = None
@@ -932,7 +1202,7 @@ elif st.session_state.page == "otp_verification":
         with col1:
             if st.button("Send OTP", key="send_otp_btn", use_container_width=True, type="primary"):
                 if input_email:
-                    conn = sqlite3.connect("users.db")
+                    conn = database.connect()
                     cursor = conn.cursor()
                     cursor.execute("SELECT username FROM users WHERE email = ?", (input_email,))
                     result = cursor.fetchone()
@@ -1104,7 +1374,7 @@ elif st.session_state.page == "change_password":
                 st.error("Password must be at least 6 characters long.")
             else:
                 try:
-                    conn = sqlite3.connect("users.db")
+                    conn = database.connect()
                     cursor = conn.cursor()
                     cursor.execute("UPDATE users SET password = ? WHERE email = ?", 
                                  (new_password, st.session_state.otp_email))
@@ -1163,20 +1433,20 @@ elif st.session_state.page == "admin_dashboard":
     
     col1, col2, col3 = st.columns(3)
     
-    conn = sqlite3.connect("users.db")
+    conn = database.connect()
     cursor = conn.cursor()
     
-    cursor.execute("SELECT COUNT(*) FROM users WHERE user_type = 'farmer'")
-    total_farmers = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM users WHERE user_type = 'admin'")
-    total_admins = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM history")
-    total_detections = cursor.fetchone()[0]
+    cursor.execute("SELECT user_type, COUNT(*) FROM users GROUP BY user_type")
+    user_counts = dict(cursor.fetchall())
+    total_farmers = user_counts.get("farmer", 0)
+    total_admins = user_counts.get("admin", 0)
     
     conn.close()
     
+    # Detection counters come from the daily rollup, not a scan of history
+    detection_summary = rollups.summary()
+    total_detections = detection_summary["total"]
+    
     with col1:
         st.markdown(f"""
             <div class="metric-card">
@@ -1219,14 +1489,14 @@ elif st.session_state.page == "admin_dashboard":
     
     with tab1:
         st.write("**Registered Users**")
-        conn = sqlite3.connect("users.db")
+        conn = database.connect()
         users_df = pd.read_sql_query("SELECT id, username, email, user_type FROM users", conn)
         conn.close()
         st.dataframe(users_df, use_container_width=True)
     
     with tab2:
         st.write("**Recent Detection History**")
-        conn = sqlite3.connect("users.db")
+        conn = database.connect()
         history_df = pd.read_sql_query("""
             SELECT h.id, u.username, h.result, h.confidence, h.created_at 
             FROM history h 
@@ -1259,7 +1529,7 @@ elif st.session_state.page == "admin_dashboard":
                 elif len(new_password) < 6:
                     st.error("Password must be at least 6 characters long")
                 else:
-                    conn = sqlite3.connect("users.db")
+                    conn = database.connect()
                     cursor = conn.cursor()
                     
                     # Verify current password
@@ -1290,7 +1560,7 @@ elif st.session_state.page == "admin_dashboard":
         # ========== DELETE USER ACCOUNTS ==========
         st.markdown("#### Delete User Accounts")
         
-        conn = sqlite3.connect("users.db")
+        conn = database.connect()
         all_users_df = pd.read_sql_query("""
             SELECT id, username, email, user_type, created_at 
             FROM users 
@@ -1316,7 +1586,7 @@ elif st.session_state.page == "admin_dashboard":
                 st.markdown("<br>", unsafe_allow_html=True)
                 if st.button("Delete User", type="secondary"):
                     # Verify user exists and is not current admin
-                    conn = sqlite3.connect("users.db")
+                    conn = database.connect()
                     cursor = conn.cursor()
                     
                     cursor.execute("SELECT username FROM users WHERE id = ?", (user_id_to_delete,))
@@ -1345,7 +1615,7 @@ elif st.session_state.page == "admin_dashboard":
         # ========== EDIT USER ROLES ==========
         st.markdown("#### Edit User Roles")
         
-        conn = sqlite3.connect("users.db")
+        conn = database.connect()
         users_for_role_df = pd.read_sql_query("""
             SELECT id, username, email, user_type 
             FROM users 
@@ -1380,7 +1650,7 @@ elif st.session_state.page == "admin_dashboard":
                     if new_role == current_role:
                         st.warning("User already has this role")
                     else:
-                        conn = sqlite3.connect("users.db")
+                        conn = database.connect()
                         cursor = conn.cursor()
                         
                         cursor.execute("UPDATE users SET user_type = ? WHERE id = ?", 
@@ -1439,36 +1709,23 @@ elif st.session_state.page == "admin_dashboard":
         # ========== SYSTEM SUMMARY ==========
         st.markdown("#### System Summary")
         
-        conn = sqlite3.connect("users.db")
+        conn = database.connect()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT COUNT(*) FROM users WHERE user_type = 'farmer'")
-        total_farmers = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM users WHERE user_type = 'admin'")
-        total_admins = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM history")
-        total_detections = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
-        
-        # Get recent activity
-        cursor.execute("""
-            SELECT COUNT(*) FROM history 
-            WHERE DATE(created_at) = DATE('now')
-        """)
-        today_detections = cursor.fetchone()[0]
-        
-        cursor.execute("""
-            SELECT COUNT(*) FROM history 
-            WHERE DATE(created_at) >= DATE('now', '-7 days')
-        """)
-        week_detections = cursor.fetchone()[0]
+        cursor.execute("SELECT user_type, COUNT(*) FROM users GROUP BY user_type")
+        user_counts = dict(cursor.fetchall())
+        total_farmers = user_counts.get("farmer", 0)
+        total_admins = user_counts.get("admin", 0)
+        total_users = sum(user_counts.values())
         
         conn.close()
         
+        # Get recent activity from the daily rollup
+        detection_summary = rollups.summary()
+        total_detections = detection_summary["total"]
+        today_detections = detection_summary["today"]
+        week_detections = detection_summary["week"]
+        
         col_sum1, col_sum2, col_sum3, col_sum4 = st.columns(4)
         
         with col_sum1:
@@ -1838,7 +2095,7 @@ elif st.session_state.page == "otp_verification":
         with col1:
             if st.button("Send OTP", key="send_otp_btn", use_container_width=True, type="primary"):
                 if input_email:
-                    conn = sqlite3.connect("users.db")
+                    conn = database.connect()
                     cursor = conn.cursor()
                     cursor.execute("SELECT username FROM users WHERE email = ?", (input_email,))
                     result = cursor.fetchone()
@@ -2010,7 +2267,7 @@ elif st.session_state.page == "change_password":
                 st.error("Password must be at least 6 characters long.")
             else:
                 try:
-                    conn = sqlite3.connect("users.db")
+                    conn = database.connect()
                     cursor = conn.cursor()
                     cursor.execute("UPDATE users SET password = ? WHERE email = ?", 
                                  (new_password, st.session_state.otp_email))
@@ -2396,17 +2653,21 @@ elif st.session_state.page == "detect":
 
     # Display preview
     if image_to_use is not None:
-        image = Image.open(image_to_use)
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        # Preprocess and build the preview once per distinct photo, not on every rerun
+        raw_upload = image_to_use.getvalue()
+        upload_hash = image_store.content_hash(raw_upload)
+        if st.session_state.get("detect_upload_hash") != upload_hash:
+            st.session_state.detect_prepared = image_pipeline.preprocess(raw_upload, inference_client.MODEL_ID)
+            st.session_state.detect_upload_hash = upload_hash
+        image_bytes, preprocess_report = st.session_state.detect_prepared
+        img_str = base64.b64encode(image_pipeline.make_preview(raw_upload, upload_hash)).decode()
 
         st.markdown(f"""
         <div class="upload-section">
             <img src="https://cdn-icons-png.flaticon.com/128/2659/2659360.png" width="50" style="margin-bottom: 15px;">
             <div class="upload-text">Image Preview</div>
             <div class="upload-subtext">Ready for analysis</div>
-            <img src="data:image/png;base64,{img_str}" class="preview-image" width="300">
+            <img src="data:image/webp;base64,{img_str}" class="preview-image" width="300">
         </div>
         """, unsafe_allow_html=True)
     else:
@@ -2418,63 +2679,168 @@ elif st.session_state.page == "detect":
         </div>
         """, unsafe_allow_html=True)
  
+    # High-resolution mode scans overlapping tiles so small lesions are not lost to downscaling
+    use_tiling = False
+    if image_to_use is not None and image_pipeline.needs_tiling(preprocess_report["original_size"], inference_client.MODEL_ID):
+        use_tiling = st.checkbox(
+            "High-resolution scan (slower, finds small lesions in wide shots)",
+            key="detect_tiled"
+        )
+
     # Detect button
     if st.button("DETECT DISEASE", key="detect_btn", use_container_width=True, type="primary"):
+        quality = image_pipeline.quality_gate(image_bytes) if image_to_use is not None else None
         if image_to_use is None:
             st.error("Please upload an image or take a photo first.")
+        elif not quality["passed"] and not st.session_state.get("detect_skip_gate"):
+            # Checked before any inference call so poor photos don't use up the quota
+            for reason in quality["rejections"]:
+                st.error(reason)
+            st.session_state.detect_gate_failed = True
         else:
-            with st.spinner("Analyzing image..."):
-                try:
-                    import tempfile
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-                        image.save(tmp_file, format="JPEG")
-                        tmp_file_path = tmp_file.name
-                    
-                    client = init_client()
-                    result = client.infer(tmp_file_path, model_id="palayprotector-project/1")
-                    
-                    if result.get("predictions"):
-                        for pred in result["predictions"]:
-                            disease = pred["class"]
-                            confidence = pred["confidence"] * 100
-                            
-                            st.markdown(f"""
-                            <div class='result-box disease-result'>
-                                <h2 style="margin: 0 0 15px 0; color: #2e7d32;">Detection Result</h2>
-                                <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 15px;">
-                                    <span style="font-weight: bold; color: #d32f2f; font-size: 28px;">{disease}</span>
-                                    <span style="font-weight: bold; color: #2e7d32; font-size: 24px;">{confidence:.1f}%</span>
-                                </div>
-                                <div class="confidence-bar">
-                                    <div class="confidence-fill" style="width: {confidence}%;"></div>
-                                </div>
-                            </div>
-                            """, unsafe_allow_html=True)
-                            
-                            conn = sqlite3.connect("users.db")
-                            cursor = conn.cursor()
-                            cursor.execute("""
-                                INSERT INTO history (user_id, result, confidence)
-                                VALUES (?, ?, ?)
-                            """, (st.session_state.user_id, disease, confidence))
-                            conn.commit()
-                            conn.close()
-                    else:
-                        st.markdown("""
-                        <div class='result-box'>
-                            <h2 style="margin: 0 0 15px 0; color: #2e7d32;">Detection Result</h2>
-                            <div style="text-align: center; padding: 20px;">
-                                <img src="https://cdn-icons-png.flaticon.com/128/5610/5610944.png" width="60">
-                                <h2 style="color: #2e7d32; font-size: 28px; margin: 15px 0;">Healthy Rice Plant</h2>
-                                <p style="font-size: 16px;">No diseases detected</p>
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                except Exception as e:
-                    st.error(f"Error during detection: {str(e)}")
+            preprocess_report["quality"] = quality
+            st.session_state.detect_gate_failed = False
+            st.session_state.detect_job_id = detection.submit_job(
+                st.session_state.user_id,
+                raw_upload if use_tiling else image_bytes,
+                inference_client.MODEL_ID,
+                tiled=use_tiling
+            )
+            if use_tiling:
+                # The single-image crop and resize do not apply; tiles are cut from the original photo
+                st.session_state.detect_job_report = {
+                    "tiled": True,
+                    "model_id": preprocess_report["model_id"],
+                    "original_size": preprocess_report["original_size"],
+                    "original_bytes": preprocess_report["original_bytes"],
+                    "quality": quality,
+                }
+            else:
+                st.session_state.detect_job_report = preprocess_report
+
+    if st.session_state.get("detect_gate_failed"):
+        st.checkbox("Analyze anyway", key="detect_skip_gate")
+
+    # Detection runs in the background; poll until it finishes, then show the result
+    detect_job_id = st.session_state.get("detect_job_id")
+    if detect_job_id:
+        job = detection.get_job(detect_job_id)
+        if job and job["status"] in ("queued", "running"):
+            poll_detection_job(detect_job_id)
+        elif job and job["status"] == "done":
+            if st.session_state.get("detect_job_notified") != detect_job_id:
+                st.toast("Detection complete!")
+                st.session_state.detect_job_notified = detect_job_id
+            show_detection_result(job["result"], job["source"], st.session_state.get("detect_job_report"))
+        elif job:
+            st.error(f"Error during detection: {job['error']}")
     
     st.markdown("<br>", unsafe_allow_html=True)
+
+    # ===== BATCH DETECTION =====
+    with st.expander("Batch Detection (multiple photos)"):
+        batch_files = st.file_uploader(
+            "Choose images",
+            type=["jpg", "jpeg", "png"],
+            accept_multiple_files=True,
+            key="batch_upload"
+        )
+
+        if st.button("DETECT BATCH", key="detect_batch_btn", use_container_width=True):
+            if not batch_files:
+                st.error("Please upload one or more images first.")
+            else:
+                progress = st.progress(0.0, text="Analyzing images...")
+
+                def show_batch_progress(done, total, outcome):
+                    progress.progress(done / total, text=f"Analyzed {done} of {total}: {outcome['name']}")
+
+                batch_start = time.perf_counter()
+                outcomes = detection.run_batch(
+                    [(f.name, f.getvalue()) for f in batch_files],
+                    on_progress=show_batch_progress,
+                    store_images=True,
+                    store_healthy=False,
+                    user_id=st.session_state.user_id
+                )
+                batch_seconds = time.perf_counter() - batch_start
+
+                detection.save_scans(st.session_state.user_id, [
+                    {
+                        "result": o["result"],
+                        "model_id": o["report"]["model_id"],
+                        "latency_ms": o["report"]["infer_ms"],
+                        "image_hash": o["report"]["image_hash"],
+                        "duplicate_of": o["report"]["duplicate_of"],
+                    }
+                    for o in outcomes if o["result"] is not None
+                ])
+
+                table_rows = []
+                for outcome in outcomes:
+                    if outcome["error"]:
+                        table_rows.append({"Image": outcome["name"], "Result": "Error", "Confidence": "", "Detail": outcome["error"]})
+                        continue
+                    summary = postprocess.summarize(outcome["result"])
+                    table_rows.append({
+                        "Image": outcome["name"],
+                        "Result": summary["diagnosis"] if summary["confidence"] else "Healthy Rice Plant",
+                        "Confidence": f"{summary['confidence']:.1f}%" if summary["confidence"] else "",
+                        "Detail": ", ".join(f"{c['class']} x{c['count']}" for c in summary["classes"]),
+                    })
+                st.dataframe(pd.DataFrame(table_rows), use_container_width=True, hide_index=True)
+                st.caption(f"Analyzed {len(outcomes)} images in {batch_seconds:.1f}s")
+
+    # ===== VIDEO FIELD SCAN =====
+    with st.expander("Video Field Scan (walk-through video)"):
+        video_file = st.file_uploader("Choose a video", type=["mp4", "mov", "avi"], key="video_upload")
+
+        if st.button("SCAN VIDEO", key="scan_video_btn", use_container_width=True):
+            if video_file is None:
+                st.error("Please upload a video first.")
+            else:
+                progress = st.progress(0.0, text="Picking keyframes...")
+
+                def show_video_progress(done, total, outcome):
+                    progress.progress(done / total, text=f"Analyzed frame {done} of {total} (at {outcome['name']})")
+
+                try:
+                    field, outcomes, video_report = detection.run_video_scan(
+                        video_file.getvalue(), on_progress=show_video_progress
+                    )
+                except ValueError as e:
+                    st.error(f"Could not read video: {e}")
+                else:
+                    progress.progress(1.0, text="Field scan complete")
+                    if field["diagnosis"] != "Healthy":
+                        detection.save_diagnoses(
+                            st.session_state.user_id,
+                            [(field["diagnosis"], field["confidence"])],
+                            image_hashes=[video_report["image_hash"]]
+                        )
+
+                    st.markdown(f"""
+                    <div class='result-box {"disease-result" if field["diagnosis"] != "Healthy" else ""}'>
+                        <h2 style="margin: 0 0 15px 0; color: #2e7d32;">Field Report</h2>
+                        <div style="font-weight: bold; font-size: 24px; color: {'#d32f2f' if field['diagnosis'] != 'Healthy' else '#2e7d32'};">
+                            {field['diagnosis'] if field['diagnosis'] != 'Healthy' else 'Healthy Field'}
+                        </div>
+                        <p>{field['diseased_frames']} of {field['frames']} distinct views show disease</p>
+                    </div>
+                    """, unsafe_allow_html=True)
+                    if field["classes"]:
+                        st.dataframe(pd.DataFrame([
+                            {
+                                "Disease": c["class"],
+                                "Views Affected": f"{c['prevalence'] * 100:.0f}%",
+                                "Spots": c["detections"],
+                                "Best Confidence": f"{c['max_confidence']:.1f}%",
+                            }
+                            for c in field["classes"]
+                        ]), use_container_width=True, hide_index=True)
+                    st.caption(f"{video_report['duration_seconds']:.0f}s video: {video_report['frames_sampled']} frames sampled, "
+                               f"{video_report['keyframes']} keyframes scanned ({video_report['rejected']} too blurry or dark, "
+                               f"{video_report['errors']} failed)")
     
 
     show_bottom_nav('detect')
@@ -2494,16 +2860,20 @@ elif st.session_state.page == "history":
     if st.session_state.user_id is None:
         st.warning("⚠ Please log in to view your history.")
     else:
-        conn = sqlite3.connect("users.db")
+        conn = database.connect()
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT created_at, result, confidence
+            SELECT created_at, result, confidence, image_hash, duplicate_of
             FROM history
             WHERE user_id = ?
             ORDER BY created_at DESC
-        """, (st.session_state.user_id,))
+            LIMIT ?
+        """, (st.session_state.user_id, st.session_state.history_limit + 1))
         rows = cursor.fetchall()
         conn.close()
+        # One extra row tells whether there is more to show
+        has_more = len(rows) > st.session_state.history_limit
+        rows = rows[:st.session_state.history_limit]
 
         if rows:
             from datetime import datetime
@@ -2548,9 +2918,16 @@ elif st.session_state.page == "history":
                 .remedy-btn:hover {
                     background: #1b5e20;
                 }
+                .history-thumb {
+                    width: 64px;
+                    height: 64px;
+                    object-fit: cover;
+                    border-radius: 6px;
+                }
             </style>
             <table class="history-table">
                 <tr>
+                    <th>Photo</th>
                     <th>Date</th>
                     <th>Disease</th>
                     <th>Confidence</th>
@@ -2558,17 +2935,21 @@ elif st.session_state.page == "history":
                 </tr>
             """
 
-            for date, disease, conf in rows:
+            store = image_store.get_store()
+            for date, disease, conf, image_hash, duplicate_of in rows:
                 try:
                     d_obj = datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
                     f_date = d_obj.strftime("%Y-%m-%d")
                 except:
                     f_date = date
+                thumb_uri = store.thumbnail_data_uri(image_hash)
+                thumb_html = f'<img src="{thumb_uri}" class="history-thumb">' if thumb_uri else ""
 
                 table_html += f"""
                 <tr>
+                    <td>{thumb_html}</td>
                     <td>{f_date}</td>
-                    <td>{disease}</td>
+                    <td>{disease}{'<br><small>Repeat scan</small>' if duplicate_of else ''}</td>
                     <td>{conf:.2f}%</td>
                     <td><a href="https://collab-app.com/dashboard?disease={disease}" 
                            target="_blank" class="remedy-btn">View Remedy</a></td>
@@ -2579,6 +2960,12 @@ elif st.session_state.page == "history":
 
             st.components.v1.html(table_html, height=400, scrolling=True)
 
+            if has_more:
+                st.caption(f"Showing your {len(rows)} most recent scans")
+                if st.button("Show more", key="history_show_more"):
+                    st.session_state.history_limit += HISTORY_PAGE_SIZE
+                    st.rerun()
+
         else:
             st.info("No history records yet.")
 
@@ -3148,31 +3535,17 @@ elif st.session_state.page == "profile":
     detected_count = 0
     
     try:
-        # Connect to users.db (your actual database)
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Query to get user statistics from HISTORY table
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_scans,
-                SUM(CASE WHEN result = 'Healthy' THEN 1 ELSE 0 END) as healthy_count,
-                SUM(CASE WHEN result != 'Healthy' THEN 1 ELSE 0 END) as detected_count
-            FROM history
-            WHERE user_id = ?
-        """, (st.session_state.user_id,))
-        
-        stats = cursor.fetchone()
-        if stats:
-            total_scans = stats[0] if stats[0] else 0
-            healthy_count = stats[1] if stats[1] else 0
-            detected_count = stats[2] if stats[2] else 0
-        
-        conn.close()
+        # Totals are kept current by triggers on history (see user_stats.py), so this
+        # costs the same however many scans the user has
+        stats = user_stats.get_user_stats(st.session_state.user_id)
+        total_scans = stats["total_scans"]
+        healthy_count = stats["healthy_count"]
+        detected_count = stats["detected_count"]
         
     except Exception as e:
         # If database error, show 0
         st.warning(f"Could not load statistics: {e}")
+        stats = None
         total_scans = 0
         healthy_count = 0
         detected_count = 0
@@ -3217,6 +3590,11 @@ elif st.session_state.page == "profile":
         </div>
         """, unsafe_allow_html=True)
     
+    if stats and stats["diseases"]:
+        st.caption("Most detected: " + ", ".join(
+            f"{entry['disease']} ({entry['count']})" for entry in stats["diseases"][:3]
+        ))
+    
     st.markdown("<br>", unsafe_allow_html=True)
     
     # Recent Activity Section
@@ -3226,12 +3604,12 @@ elif st.session_state.page == "profile":
     recent_scans = []
     
     try:
-        conn = sqlite3.connect('users.db')
+        conn = database.connect()
         cursor = conn.cursor()
         
         # Query to get recent 3 scans from HISTORY table
         cursor.execute("""
-            SELECT created_at, result, confidence
+            SELECT created_at, result, confidence, image_hash
             FROM history
             WHERE user_id = ?
             ORDER BY created_at DESC
@@ -3250,7 +3628,8 @@ elif st.session_state.page == "profile":
             recent_scans.append({
                 "date": formatted_date,
                 "result": row[1],
-                "confidence": f"{row[2]:.1f}%"
+                "confidence": f"{row[2]:.1f}%",
+                "thumbnail": image_store.get_store().thumbnail_data_uri(row[3])
             })
         
         conn.close()
@@ -3263,13 +3642,18 @@ elif st.session_state.page == "profile":
     if recent_scans:
         for scan in recent_scans:
             result_color = "#28a745" if scan["result"] == "Healthy" else "#dc3545"
+            thumb_html = (f'<img src="{scan["thumbnail"]}" style="width: 48px; height: 48px; object-fit: cover; '
+                          f'border-radius: 6px; margin-right: 12px;">' if scan["thumbnail"] else "")
             st.markdown(f"""
             <div class="info-section">
                 <div style="display: flex; justify-content: space-between; align-items: center;">
+                    <div style="display: flex; align-items: center;">
+                    {thumb_html}
                     <div>
                         <strong style="color: {result_color};">{scan["result"]}</strong>
                         <div style="color: #6c757d; font-size: 0.85rem;">{scan["date"]}</div>
                     </div>
+                    </div>
                     <div style="color: #667eea; font-weight: bold;">
                         {scan["confidence"]}
                     </div>
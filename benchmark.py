@@ -0,0 +1,236 @@
+"""Headless latency benchmark for the detect pipeline.
+
+Replays a directory of rice-leaf photos through the same stages the detect page
+uses (decode/preprocess -> quality gate -> infer -> summarize -> persist) and
+reports p50/p95/p99 per stage, throughput per concurrency level and bytes uploaded.
+Compare a run with --no-crop to see the latency the leaf crop saves.
+
+    python benchmark.py samples/ --start-mock --mock-latency lognormal:0.6:0.3 --concurrency 1,4,8
+    python benchmark.py samples/ --backend roboflow --concurrency 4 --json results.json
+
+Results are written as JSON so runs from different releases can be diffed.
+"""
+
+# ========== IMPORTS ==========
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import detection
+import image_pipeline
+import inference_client
+import migrations
+import mock_inference_server
+import postprocess
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+STAGES = ["preprocess", "gate", "infer", "postprocess", "persist", "total"]
+
+
+# ========== PIPELINE REPLAY ==========
+def load_corpus(image_dir, limit=None):
+    """Read (name, raw_bytes) for every image in a directory, sorted by name"""
+    names = sorted(n for n in os.listdir(image_dir) if n.lower().endswith(IMAGE_EXTENSIONS))
+    if limit:
+        names = names[:limit]
+    corpus = []
+    for name in names:
+        with open(os.path.join(image_dir, name), "rb") as f:
+            corpus.append((name, f.read()))
+    return corpus
+
+
+def make_scratch_db():
+    """Temporary history database so benchmark writes never touch users.db"""
+    fd, path = tempfile.mkstemp(suffix=".db", prefix="palay-bench-")
+    os.close(fd)
+    migrations.migrate(path)
+    return path
+
+
+def run_one(name, raw_bytes, client, model_id, db_path, gate=True, persist=True, crop=True):
+    """Time each stage for one image; returns a sample dict"""
+    sample = {"name": name, "original_bytes": len(raw_bytes), "uploaded_bytes": 0, "roi_bytes_saved": 0,
+              "error": None, "rejected": False}
+    start = time.perf_counter()
+
+    stage_start = time.perf_counter()
+    image_bytes, report = image_pipeline.preprocess(raw_bytes, model_id, crop_leaf=crop)
+    sample["preprocess"] = (time.perf_counter() - stage_start) * 1000
+    sample["roi_bytes_saved"] = report["roi_bytes_saved"]
+
+    if gate:
+        stage_start = time.perf_counter()
+        quality = image_pipeline.quality_gate(image_bytes)
+        sample["gate"] = (time.perf_counter() - stage_start) * 1000
+        if not quality["passed"]:
+            sample["rejected"] = True
+            sample["total"] = (time.perf_counter() - start) * 1000
+            return sample
+
+    stage_start = time.perf_counter()
+    try:
+        result = client.infer(image_bytes, model_id=model_id)
+    except Exception as e:
+        sample["error"] = inference_client.describe_error(e)
+        sample["total"] = (time.perf_counter() - start) * 1000
+        return sample
+    sample["infer"] = (time.perf_counter() - stage_start) * 1000
+    sample["uploaded_bytes"] = report["processed_bytes"]
+
+    stage_start = time.perf_counter()
+    summary = postprocess.summarize(result)
+    sample["postprocess"] = (time.perf_counter() - stage_start) * 1000
+    sample["diagnosis"] = summary["diagnosis"]
+
+    if persist:
+        stage_start = time.perf_counter()
+        detection.save_scans(0, [{"result": result, "model_id": model_id, "latency_ms": sample["infer"]}], db_path=db_path)
+        sample["persist"] = (time.perf_counter() - stage_start) * 1000
+
+    sample["total"] = (time.perf_counter() - start) * 1000
+    return sample
+
+
+def run_level(corpus, concurrency, repeat, client, model_id, db_path, gate, persist, crop):
+    """Replay the corpus `repeat` times at one concurrency level"""
+    work = [item for _ in range(repeat) for item in corpus]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(
+            lambda item: run_one(item[0], item[1], client, model_id, db_path, gate, persist, crop), work
+        ))
+    wall_seconds = time.perf_counter() - start
+    return samples, wall_seconds
+
+
+# ========== REPORTING ==========
+def percentiles(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(np.mean(values)), "n": len(values)}
+
+
+def summarize_level(samples, wall_seconds, concurrency):
+    completed = [s for s in samples if not s["error"] and not s["rejected"]]
+    return {
+        "concurrency": concurrency,
+        "images": len(samples),
+        "completed": len(completed),
+        "errors": sum(1 for s in samples if s["error"]),
+        "rejected": sum(1 for s in samples if s["rejected"]),
+        "wall_seconds": wall_seconds,
+        "throughput_per_second": len(samples) / wall_seconds if wall_seconds else 0.0,
+        "original_bytes": sum(s["original_bytes"] for s in samples),
+        "uploaded_bytes": sum(s["uploaded_bytes"] for s in samples),
+        "roi_bytes_saved": sum(s["roi_bytes_saved"] for s in samples),
+        "stages_ms": {stage: percentiles([s[stage] for s in samples if stage in s]) for stage in STAGES},
+    }
+
+
+def print_level(level):
+    print(f"\nconcurrency={level['concurrency']}  images={level['images']}  "
+          f"throughput={level['throughput_per_second']:.2f}/s  wall={level['wall_seconds']:.2f}s  "
+          f"errors={level['errors']}  rejected={level['rejected']}")
+    print(f"uploaded {level['uploaded_bytes'] / 1024:.0f} KB of {level['original_bytes'] / 1024:.0f} KB original "
+          f"({level['roi_bytes_saved'] / 1024:.0f} KB saved by leaf cropping)")
+    print(f"{'stage':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'n':>6}")
+    for stage, stats in level["stages_ms"].items():
+        if stats:
+            print(f"{stage:<12}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}{stats['n']:>6}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+# ========== ENTRY POINT ==========
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Palay Protector detect pipeline")
+    parser.add_argument("image_dir", help="directory of .jpg/.jpeg/.png rice leaf photos")
+    parser.add_argument("--backend", default=inference_client.BACKEND, choices=["roboflow", "local", "mock"])
+    parser.add_argument("--model-id", default=inference_client.MODEL_ID)
+    parser.add_argument("--concurrency", default="1,4,8", help="comma-separated concurrency levels")
+    parser.add_argument("--repeat", type=int, default=1, help="times to replay the corpus per level")
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N images")
+    parser.add_argument("--no-gate", action="store_true", help="skip the image quality gate")
+    parser.add_argument("--no-persist", action="store_true", help="skip the history write stage")
+    parser.add_argument("--no-crop", action="store_true", help="upload the full frame instead of the leaf crop")
+    parser.add_argument("--start-mock", action="store_true", help="run mock_inference_server in-process")
+    parser.add_argument("--mock-latency", default="fixed:0.3", help="latency spec for --start-mock")
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--json", dest="json_path", default=None, help="write machine-readable results here")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.image_dir, args.limit)
+    if not corpus:
+        sys.exit(f"No images found in {args.image_dir}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    mock_server = None
+    if args.start_mock:
+        mock_server = mock_inference_server.make_server(port=0, config=mock_inference_server.MockConfig(
+            latency=args.mock_latency, error_rate=args.mock_error_rate, seed=0
+        ))
+        threading.Thread(target=mock_server.serve_forever, daemon=True).start()
+        backend = inference_client.PooledInferenceClient(
+            api_url=f"http://127.0.0.1:{mock_server.server_address[1]}", pool_size=max(levels)
+        )
+        client = inference_client.ResilientBackend(backend)
+        backend_name = "mock"
+    else:
+        client = inference_client.create_resilient_backend(args.backend)
+        backend_name = args.backend
+
+    db_path = make_scratch_db()
+    results = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "backend": backend_name,
+        "model_id": args.model_id,
+        "corpus": {"directory": os.path.abspath(args.image_dir), "images": len(corpus),
+                   "bytes": sum(len(raw) for _, raw in corpus)},
+        "repeat": args.repeat,
+        "leaf_crop": not args.no_crop,
+        "levels": [],
+    }
+    try:
+        # One warm-up pass so connection setup and lazy imports don't skew the first level
+        run_one(corpus[0][0], corpus[0][1], client, args.model_id, db_path, not args.no_gate, False, not args.no_crop)
+        for concurrency in levels:
+            samples, wall_seconds = run_level(corpus, concurrency, args.repeat, client, args.model_id,
+                                              db_path, not args.no_gate, not args.no_persist, not args.no_crop)
+            level = summarize_level(samples, wall_seconds, concurrency)
+            results["levels"].append(level)
+            print_level(level)
+    finally:
+        for path in (db_path, db_path + "-wal", db_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        if mock_server:
+            mock_server.shutdown()
+
+    results["client"] = client.stats()
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
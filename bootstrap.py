@@ -0,0 +1,68 @@
+# ========== IMPORTS ==========
+import io
+import threading
+import time
+
+from PIL import Image
+
+import database
+import inference_client
+import migrations
+import result_cache
+
+# ========== CONFIGURATION ==========
+LOGO_PATH = "ver 2.0 logo.png"
+
+
+# ========== STARTUP STEPS ==========
+def load_logo(path=LOGO_PATH):
+    """Logo file bytes, checked once so reruns can hand them to st.image without re-encoding"""
+    try:
+        with open(path, "rb") as f:
+            logo = f.read()
+        Image.open(io.BytesIO(logo)).verify()
+        return logo
+    except Exception as e:
+        print(f"Could not load logo {path}: {e}")
+        return None
+
+
+def _timed(timings, name, step):
+    start = time.perf_counter()
+    value = step()
+    timings[name] = (time.perf_counter() - start) * 1000
+    return value
+
+
+def _run():
+    started_at = time.time()
+    start = time.perf_counter()
+    timings = {}
+    _timed(timings, "database", lambda: migrations.ensure_migrated(database.DB_PATH))
+    logo = _timed(timings, "logo", load_logo)
+    _timed(timings, "inference_client", inference_client.get_client)
+    _timed(timings, "result_cache", result_cache.get_cache)
+    total_ms = (time.perf_counter() - start) * 1000
+    print("Startup finished in {:.0f} ms ({})".format(
+        total_ms, ", ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items())
+    ))
+    return {"logo": logo, "timings": timings, "total_ms": total_ms, "started_at": started_at}
+
+
+# ========== SHARED INSTANCE ==========
+_resources = None
+_resources_lock = threading.Lock()
+
+
+def get_resources():
+    """Run process startup on the first call and return the shared resources
+
+    Later calls, i.e. every Streamlit rerun, return the same dict without touching
+    the schema or the filesystem.
+    """
+    global _resources
+    if _resources is None:
+        with _resources_lock:
+            if _resources is None:
+                _resources = _run()
+    return _resources
@@ -0,0 +1,218 @@
+# ========== IMPORTS ==========
+import hashlib
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from PIL import UnidentifiedImageError
+
+import database
+import detection
+import image_pipeline
+import inference_client
+import postprocess
+
+# ========== CONFIGURATION ==========
+INGEST_WORKERS = int(os.environ.get("PALAY_INGEST_WORKERS", "4"))
+# Entries larger than this (uncompressed) are skipped rather than read into memory
+MAX_ENTRY_BYTES = int(os.environ.get("PALAY_INGEST_MAX_ENTRY_BYTES", str(50 * 1024 * 1024)))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+UNREADABLE_IMAGE = "Not a readable image; the file may be corrupt or not a photo"
+
+
+def archive_hash(archive):
+    """SHA-256 of a file-like archive, read in chunks; identifies a run for resuming"""
+    digest = hashlib.sha256()
+    archive.seek(0)
+    for chunk in iter(lambda: archive.read(1024 * 1024), b""):
+        digest.update(chunk)
+    archive.seek(0)
+    return digest.hexdigest()
+
+
+def image_entries(zip_file):
+    """Image members of an archive, skipping folders, hidden files and macOS metadata"""
+    entries = []
+    for info in zip_file.infolist():
+        name = info.filename
+        base = os.path.basename(name)
+        if info.is_dir() or not base or base.startswith(".") or name.startswith("__MACOSX/"):
+            continue
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            entries.append(info)
+    return entries
+
+
+# ========== CHECKPOINTS ==========
+def _start_run(conn, digest, archive_name, user_id, model_id, total):
+    """Reuse the unfinished run for this archive, or open a new one; returns the run id"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id FROM ingest_runs
+        WHERE archive_hash = ? AND model_id = ? AND status != 'done'
+        ORDER BY id DESC LIMIT 1
+    """, (digest, model_id))
+    row = cursor.fetchone()
+    if row:
+        cursor.execute("UPDATE ingest_runs SET status = 'running' WHERE id = ?", (row[0],))
+        conn.commit()
+        return row[0]
+    cursor.execute("""
+        INSERT INTO ingest_runs (archive_hash, archive_name, user_id, model_id, total, status)
+        VALUES (?, ?, ?, ?, ?, 'running')
+    """, (digest, archive_name, user_id, model_id, total))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def _checkpoint(conn, run_id, entry_name, outcome):
+    summary = postprocess.summarize(outcome["result"]) if outcome["result"] is not None else None
+    conn.execute("""
+        INSERT OR REPLACE INTO ingest_items (run_id, entry_name, status, diagnosis, confidence, image_hash, error)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (
+        run_id,
+        entry_name,
+        outcome["status"],
+        summary["diagnosis"] if summary else None,
+        summary["confidence"] if summary else None,
+        (outcome["report"] or {}).get("image_hash"),
+        outcome["error"],
+    ))
+    conn.commit()
+
+
+# ========== INGEST ==========
+def _detect_entry(raw_bytes, model_id, client, user_id):
+    outcome = {"result": None, "report": None, "error": None, "status": "done"}
+    try:
+        outcome["result"], outcome["report"] = detection.run_detection(
+            raw_bytes, model_id, client, store_image=True, user_id=user_id
+        )
+    except image_pipeline.QualityRejected as e:
+        outcome["status"] = "skipped"
+        outcome["error"] = str(e)
+    except Exception as e:
+        # Only trouble reaching the service is worth retrying on resume; anything else
+        # would fail the same way every time and keep the run from finishing
+        if isinstance(e, inference_client.CircuitOpenError) or inference_client.is_retryable(e):
+            outcome["status"] = "failed"
+        else:
+            outcome["status"] = "skipped"
+        if isinstance(e, (UnidentifiedImageError, ValueError, OSError)) and not isinstance(e, requests.RequestException):
+            # PIL's messages include the repr of its BytesIO, which means nothing to users
+            outcome["error"] = UNREADABLE_IMAGE
+        else:
+            outcome["error"] = inference_client.describe_error(e)
+    return outcome
+
+
+def ingest_archive(archive, archive_name, user_id, model_id=inference_client.MODEL_ID,
+                   max_workers=INGEST_WORKERS, on_progress=None, db_path=database.DB_PATH):
+    """Detect every image in a ZIP of survey photos, checkpointing each one in SQLite
+
+    Entries are read one at a time from the archive and at most 2 * max_workers are
+    held in memory. Every finished image is recorded right away, so running the same
+    archive again after an interruption only processes what is left. Images that
+    failed because the detection service was unreachable are retried on resume;
+    skipped ones (poor quality, unreadable, rejected by the service) are not. A run
+    that ends with failed images is left 'partial', so uploading the archive again
+    resumes it.
+
+    on_progress(done, total, entry_name) is called from the calling thread.
+    Returns the run id.
+    """
+    digest = archive_hash(archive)
+    conn = database.connect(db_path)
+    try:
+        with zipfile.ZipFile(archive) as zip_file:
+            entries = image_entries(zip_file)
+            run_id = _start_run(conn, digest, archive_name, user_id, model_id, len(entries))
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT entry_name FROM ingest_items
+                WHERE run_id = ? AND status IN ('done', 'skipped')
+            """, (run_id,))
+            finished = {row[0] for row in cursor.fetchall()}
+            pending = [info for info in entries if info.filename not in finished]
+
+            done = len(entries) - len(pending)
+            client = inference_client.get_client()
+            in_flight = {}
+            with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ingest") as executor:
+                for info in pending + [None]:
+                    # Drain finished work before reading more entries, so memory stays bounded
+                    while in_flight and (info is None or len(in_flight) >= 2 * max_workers):
+                        completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in completed:
+                            entry_name = in_flight.pop(future)
+                            _checkpoint(conn, run_id, entry_name, future.result())
+                            done += 1
+                            if on_progress:
+                                on_progress(done, len(entries), entry_name)
+                    if info is None:
+                        break
+                    if info.file_size > MAX_ENTRY_BYTES:
+                        _checkpoint(conn, run_id, info.filename, {
+                            "result": None, "report": None, "status": "skipped",
+                            "error": f"Image is larger than {MAX_ENTRY_BYTES // (1024 * 1024)} MB",
+                        })
+                        done += 1
+                        if on_progress:
+                            on_progress(done, len(entries), info.filename)
+                        continue
+                    # ZipFile is not safe to read from several threads, so entries are read here
+                    with zip_file.open(info) as entry:
+                        raw_bytes = entry.read()
+                    in_flight[executor.submit(_detect_entry, raw_bytes, model_id, client, user_id)] = info.filename
+
+            conn.execute("""
+                UPDATE ingest_runs
+                SET status = CASE WHEN EXISTS (
+                        SELECT 1 FROM ingest_items WHERE run_id = ingest_runs.id AND status = 'failed'
+                    ) THEN 'partial' ELSE 'done' END,
+                    finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (run_id,))
+            conn.commit()
+    finally:
+        conn.close()
+    return run_id
+
+
+# ========== RESULTS ==========
+def list_runs(db_path=database.DB_PATH, limit=20):
+    """Recent ingest runs with their progress, newest first"""
+    conn = database.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT r.id, r.archive_name, r.status, r.total, COUNT(i.entry_name),
+               COUNT(CASE WHEN i.status = 'failed' THEN 1 END), r.created_at, r.finished_at
+        FROM ingest_runs r
+        LEFT JOIN ingest_items i ON i.run_id = r.id
+        GROUP BY r.id
+        ORDER BY r.id DESC
+        LIMIT ?
+    """, (limit,))
+    rows = cursor.fetchall()
+    conn.close()
+    return [
+        dict(zip(["id", "archive_name", "status", "total", "processed", "failed", "created_at", "finished_at"], row))
+        for row in rows
+    ]
+
+
+def run_results(run_id, db_path=database.DB_PATH):
+    """Per-image results of one run, in the order they finished"""
+    conn = database.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT entry_name, status, diagnosis, confidence, image_hash, error
+        FROM ingest_items
+        WHERE run_id = ?
+        ORDER BY rowid
+    """, (run_id,))
+    rows = cursor.fetchall()
+    conn.close()
+    return [dict(zip(["entry_name", "status", "diagnosis", "confidence", "image_hash", "error"], row)) for row in rows]
@@ -0,0 +1,172 @@
+# ========== IMPORTS ==========
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+# ========== CONFIGURATION ==========
+DB_PATH = os.environ.get("PALAY_DB", "users.db")
+# Idle connections kept open per database file
+POOL_SIZE = int(os.environ.get("PALAY_DB_POOL_SIZE", "8"))
+BUSY_TIMEOUT_MS = int(os.environ.get("PALAY_DB_BUSY_TIMEOUT_MS", "5000"))
+# Statements slower than this are printed to the server log
+SLOW_QUERY_MS = float(os.environ.get("PALAY_DB_SLOW_QUERY_MS", "100"))
+
+PRAGMAS = [
+    # Readers no longer block the writer (and vice versa); the setting persists in the file
+    "PRAGMA journal_mode = WAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    # Safe with WAL: a power loss can drop the last commits but never corrupts the file
+    "PRAGMA synchronous = NORMAL",
+    # Negative means KiB: 16 MB page cache per connection
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 67108864",
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+# ========== QUERY TIMING ==========
+_query_stats = {}
+_query_stats_lock = threading.Lock()
+
+
+def _statement_key(sql):
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def _record(sql, elapsed_ms):
+    key = _statement_key(sql)
+    with _query_stats_lock:
+        stats = _query_stats.get(key)
+        if stats is None:
+            stats = _query_stats[key] = {"calls": 0, "total_ms": 0.0, "max_ms": 0.0}
+        stats["calls"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+    if elapsed_ms > SLOW_QUERY_MS:
+        print(f"Slow query ({elapsed_ms:.0f} ms): {key[:200]}")
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records how long each statement takes"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(sql, (time.perf_counter() - start) * 1000)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(sql, (time.perf_counter() - start) * 1000)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to the pool instead of closing it"""
+
+    pool = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+
+# ========== CONNECTION POOL ==========
+class ConnectionPool:
+    """Thread-safe pool of tuned connections to one database file"""
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "reused": 0, "discarded": 0}
+
+    def _open(self):
+        # Connections move between Streamlit's script threads and worker threads,
+        # but the pool guarantees only one thread uses a connection at a time
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False, factory=PooledConnection)
+        for pragma in PRAGMAS:
+            sqlite3.Connection.execute(conn, pragma)
+        conn.pool = self
+        with self._lock:
+            self._stats["opened"] += 1
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            return self._open()
+        with self._lock:
+            self._stats["reused"] += 1
+        return conn
+
+    def release(self, conn):
+        # Whatever the caller left uncommitted (e.g. after an exception) is not carried over
+        if conn.in_transaction:
+            conn.rollback()
+        if self._idle.qsize() >= self.size:
+            with self._lock:
+                self._stats["discarded"] += 1
+            sqlite3.Connection.close(conn)
+            return
+        self._idle.put(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["idle"] = self._idle.qsize()
+        stats["size"] = self.size
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path=DB_PATH):
+    """Return the pool for a database file, creating it on first use"""
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = _pools[db_path] = ConnectionPool(db_path)
+    return pool
+
+
+def connect(db_path=DB_PATH):
+    """Drop-in for sqlite3.connect(): a pooled, tuned connection; close() returns it to the pool"""
+    return get_pool(db_path).acquire()
+
+
+def pool_stats(db_path=DB_PATH):
+    return get_pool(db_path).stats()
+
+
+def query_stats(limit=10):
+    """Statements with the most total time spent, for the admin dashboard"""
+    with _query_stats_lock:
+        rows = [dict(stats, statement=sql) for sql, stats in _query_stats.items()]
+    for row in rows:
+        row["avg_ms"] = row["total_ms"] / row["calls"]
+    return sorted(rows, key=lambda row: row["total_ms"], reverse=True)[:limit]
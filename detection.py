@@ -0,0 +1,316 @@
+# ========== IMPORTS ==========
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import database
+import duplicate_index
+import image_pipeline
+import image_store
+import inference_client
+import postprocess
+import result_cache
+
+# ========== CONFIGURATION ==========
+# Concurrent inference calls per batch; keep at or below the client pool size
+BATCH_WORKERS = int(os.environ.get("PALAY_BATCH_WORKERS", "8"))
+# Background detection jobs running at once across all sessions
+JOB_WORKERS = int(os.environ.get("PALAY_JOB_WORKERS", "4"))
+
+
+# ========== SINGLE IMAGE PIPELINE ==========
+def infer_with_dedup(client, image_bytes, model_id, user_id=None):
+    """Reuse the result of the same user's near-identical earlier scan, else infer through the cache
+
+    Returns (result, source, duplicate_of) where duplicate_of is the content hash of
+    the earlier scan whose result was reused, or None. Without a user_id nothing is
+    looked up or indexed, so one user's diagnosis is never handed to another.
+    """
+    if user_id is None:
+        result, source = result_cache.cached_infer(client, image_bytes, model_id)
+        return result, source, None
+    index = duplicate_index.get_index()
+    dhash_value = image_pipeline.image_dhash(image_bytes)
+    match = index.lookup(dhash_value, image_bytes, model_id, user_id)
+    if match:
+        original_hash, result, _ = match
+        return result, "duplicate", original_hash
+    result, source = result_cache.cached_infer(client, image_bytes, model_id)
+    index.add(dhash_value, model_id, user_id, image_store.content_hash(image_bytes), result)
+    return result, source, None
+
+
+def run_detection(raw_bytes, model_id=inference_client.MODEL_ID, client=None, gate=True, store_image=False,
+                  store_healthy=True, user_id=None):
+    """Preprocess one uploaded image and run it through the cached inference client
+
+    Returns the raw inference result and a report with per-stage sizes and timings.
+    Raises image_pipeline.QualityRejected instead of calling the model on a poor photo.
+    With store_image the analysed image is kept in the scan image store and its hash
+    is reported as "image_hash"; pass store_healthy=False when only diseased scans
+    are saved (history skips healthy ones), so their photos are not kept unreferenced.
+    With a user_id, that user's near-identical earlier scans can supply the result.
+    """
+    image_bytes, report = image_pipeline.preprocess(raw_bytes, model_id)
+    if gate:
+        report["quality"] = image_pipeline.quality_gate(image_bytes)
+        if not report["quality"]["passed"]:
+            raise image_pipeline.QualityRejected(" ".join(report["quality"]["rejections"]))
+    start = time.perf_counter()
+    result, source, duplicate_of = infer_with_dedup(
+        client or inference_client.get_client(), image_bytes, model_id, user_id
+    )
+    report["infer_ms"] = (time.perf_counter() - start) * 1000
+    report["source"] = source
+    report["duplicate_of"] = duplicate_of
+    report["image_hash"] = None
+    if store_image and (store_healthy or is_saved(result)):
+        report["image_hash"] = image_store.get_store().put(image_bytes)
+    return result, report
+
+
+def run_tiled_detection(raw_bytes, model_id=inference_client.MODEL_ID, client=None, max_workers=BATCH_WORKERS):
+    """Detect on overlapping tiles of a large photo concurrently and merge them into one result"""
+    start = time.perf_counter()
+    tiles, offsets, scale, original_size = image_pipeline.make_tiles(raw_bytes, model_id)
+    client = client or inference_client.get_client()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tiles)))) as executor:
+        tile_results = list(executor.map(
+            lambda tile: result_cache.cached_infer(client, tile, model_id)[0], tiles
+        ))
+    result = {
+        "predictions": postprocess.merge_tile_predictions(tile_results, offsets, scale),
+        "image": {"width": original_size[0], "height": original_size[1]},
+        "tiles": len(tiles),
+    }
+    report = {
+        "model_id": model_id,
+        "original_bytes": len(raw_bytes),
+        "processed_bytes": sum(len(tile) for tile in tiles),
+        "infer_ms": (time.perf_counter() - start) * 1000,
+        "source": "tiled",
+    }
+    return result, report
+
+
+# ========== BATCH DETECTION ==========
+def run_batch(items, model_id=inference_client.MODEL_ID, max_workers=BATCH_WORKERS, on_progress=None,
+              store_images=False, store_healthy=True, user_id=None):
+    """Run detection on many (name, raw_bytes) items through a bounded thread pool
+
+    on_progress(done, total, outcome) is called from the calling thread as each
+    image finishes. Outcomes are returned in input order.
+    """
+    outcomes = [None] * len(items)
+    client = inference_client.get_client()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items) or 1))) as executor:
+        futures = {
+            executor.submit(run_detection, raw_bytes, model_id, client,
+                            store_image=store_images, store_healthy=store_healthy, user_id=user_id): index
+            for index, (name, raw_bytes) in enumerate(items)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            outcome = {"name": items[index][0], "result": None, "report": None, "error": None}
+            try:
+                outcome["result"], outcome["report"] = future.result()
+            except image_pipeline.QualityRejected as e:
+                outcome["error"] = f"Skipped: {e}"
+            except Exception as e:
+                outcome["error"] = inference_client.describe_error(e)
+            outcomes[index] = outcome
+            if on_progress:
+                on_progress(done, len(items), outcome)
+    return outcomes
+
+
+# ========== VIDEO SCANNING ==========
+def run_video_scan(video_bytes, model_id=inference_client.MODEL_ID, on_progress=None):
+    """Scan distinct keyframes of a field walk-through video and build one field report"""
+    # OpenCV can only demux from a file, so the upload lives on disk just for decoding
+    with tempfile.NamedTemporaryFile(suffix=".mp4") as video_file:
+        video_file.write(video_bytes)
+        video_file.flush()
+        keyframes, report = image_pipeline.extract_keyframes(video_file.name, model_id)
+
+    outcomes = run_batch(
+        [(f"{timestamp:.1f}s", frame) for timestamp, frame in keyframes],
+        model_id=model_id,
+        on_progress=on_progress
+    )
+    summaries = [postprocess.summarize(o["result"]) for o in outcomes if o["result"] is not None]
+    field = postprocess.field_report(summaries)
+
+    # Keep the keyframe that best shows the field diagnosis so the history row has a photo
+    report["image_hash"] = None
+    if field["diagnosis"] != "Healthy":
+        best_frame = None
+        best_confidence = -1.0
+        for (_, frame), outcome in zip(keyframes, outcomes):
+            if outcome["result"] is None:
+                continue
+            for entry in postprocess.summarize(outcome["result"])["classes"]:
+                if entry["class"] == field["diagnosis"] and entry["max_confidence"] > best_confidence:
+                    best_frame, best_confidence = frame, entry["max_confidence"]
+        if best_frame is not None:
+            report["image_hash"] = image_store.get_store().put(best_frame)
+
+    report["inference_calls"] = len(outcomes)
+    report["errors"] = sum(1 for o in outcomes if o["error"] and not o["error"].startswith("Skipped"))
+    report["rejected"] = sum(1 for o in outcomes if o["error"] and o["error"].startswith("Skipped"))
+    return field, outcomes, report
+
+
+# ========== HISTORY PERSISTENCE ==========
+def is_saved(result):
+    """History only keeps diseased scans"""
+    return postprocess.summarize(result)["diagnosis"] != "Healthy"
+
+
+def save_scans(user_id, scans, db_path=database.DB_PATH):
+    """Write one history row per diseased scan, with its compact prediction payload, in one transaction
+
+    Each scan is a dict with "result" and optionally "model_id", "latency_ms",
+    "image_hash" (its photo in the scan image store) and "duplicate_of" (the earlier
+    scan whose result it reused).
+    """
+    rows = []
+    for scan in scans:
+        summary = postprocess.summarize(scan["result"])
+        if summary["diagnosis"] == "Healthy":
+            continue
+        payload = postprocess.compact_predictions(scan["result"], scan.get("model_id"), scan.get("latency_ms"))
+        rows.append((user_id, summary["diagnosis"], summary["confidence"], scan.get("image_hash"), payload,
+                     scan.get("duplicate_of")))
+    return _insert_history(rows, db_path)
+
+
+def save_history(user_id, results, db_path=database.DB_PATH):
+    """Write one diagnosis row per diseased image for a list of raw results in one transaction"""
+    return save_scans(user_id, [{"result": result} for result in results], db_path)
+
+
+def save_diagnoses(user_id, diagnoses, db_path=database.DB_PATH, image_hashes=None):
+    """Insert (disease, confidence %) rows that have no single raw result, e.g. a field report"""
+    rows = [
+        (user_id, disease, confidence, image_hash, None, None)
+        for (disease, confidence), image_hash in zip(diagnoses, image_hashes or [None] * len(diagnoses))
+    ]
+    return _insert_history(rows, db_path)
+
+
+def _insert_history(rows, db_path):
+    if not rows:
+        return 0
+    conn = database.connect(db_path)
+    try:
+        with conn:
+            # user_type is stamped at save time so the daily rollup keeps it through role changes
+            conn.executemany("""
+                INSERT INTO history (user_id, result, confidence, image_hash, predictions, duplicate_of, user_type)
+                VALUES (?1, ?2, ?3, ?4, ?5, ?6, (SELECT user_type FROM users WHERE id = ?1))
+            """, rows)
+    finally:
+        conn.close()
+    return len(rows)
+
+
+# ========== BACKGROUND JOBS ==========
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="detect-job")
+# Jobs queued or running in this process; anything else still pending was lost in a restart
+_active_jobs = set()
+_active_jobs_lock = threading.Lock()
+
+
+def submit_job(user_id, image_bytes, model_id=inference_client.MODEL_ID, tiled=False):
+    """Persist a detection job and hand it to the background worker pool
+
+    image_bytes is the preprocessed upload, or the original photo when tiled.
+    """
+    conn = database.connect()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO detection_jobs (user_id, model_id, status)
+        VALUES (?, ?, 'queued')
+    """, (user_id, model_id))
+    job_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+
+    with _active_jobs_lock:
+        _active_jobs.add(job_id)
+    _job_executor.submit(_run_job, job_id, user_id, image_bytes, model_id, tiled)
+    return job_id
+
+
+def _run_job(job_id, user_id, image_bytes, model_id, tiled=False):
+    _update_job(job_id, "running")
+    try:
+        start = time.perf_counter()
+        duplicate_of = None
+        if tiled:
+            result, report = run_tiled_detection(image_bytes, model_id)
+            source = report["source"]
+        else:
+            result, source, duplicate_of = infer_with_dedup(
+                inference_client.get_client(), image_bytes, model_id, user_id
+            )
+        if is_saved(result):
+            save_scans(user_id, [{
+                "result": result,
+                "model_id": model_id,
+                "latency_ms": (time.perf_counter() - start) * 1000,
+                "image_hash": image_store.get_store().put(image_bytes),
+                "duplicate_of": duplicate_of,
+            }])
+        _update_job(job_id, "done", source=source, result=json.dumps(result))
+    except Exception as e:
+        _update_job(job_id, "failed", error=inference_client.describe_error(e))
+    finally:
+        with _active_jobs_lock:
+            _active_jobs.discard(job_id)
+
+
+def _update_job(job_id, status, source=None, result=None, error=None):
+    conn = database.connect()
+    cursor = conn.cursor()
+    if status == "running":
+        cursor.execute("UPDATE detection_jobs SET status = ? WHERE id = ?", (status, job_id))
+    else:
+        cursor.execute("""
+            UPDATE detection_jobs
+            SET status = ?, source = ?, result = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (status, source, result, error, job_id))
+    conn.commit()
+    conn.close()
+
+
+def get_job(job_id):
+    """Return a job's status, result and error as a dict, or None if it does not exist"""
+    # Check before reading so a job finishing mid-read is not mistaken for a lost one
+    with _active_jobs_lock:
+        active = job_id in _active_jobs
+
+    conn = database.connect()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, user_id, model_id, status, source, result, error, created_at, finished_at
+        FROM detection_jobs WHERE id = ?
+    """, (job_id,))
+    row = cursor.fetchone()
+    conn.close()
+    if not row:
+        return None
+
+    job = dict(zip(
+        ["id", "user_id", "model_id", "status", "source", "result", "error", "created_at", "finished_at"], row
+    ))
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    if job["status"] in ("queued", "running") and not active:
+        job["status"] = "failed"
+        job["error"] = "Detection was interrupted by a server restart. Please try again."
+    return job
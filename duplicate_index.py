@@ -0,0 +1,186 @@
+# ========== IMPORTS ==========
+import itertools
+import json
+import os
+import threading
+import time
+
+import database
+import image_pipeline
+import image_store
+
+# ========== CONFIGURATION ==========
+# A 64-bit dHash only sees the leaf's outline; different lesion patterns on the same
+# kind of leaf land a few bits apart. Hashes this close only make a scan a candidate.
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get("PALAY_DUPLICATE_DISTANCE", "4"))
+# A candidate is confirmed only if at most this many of the 256x256 compared pixels
+# changed; re-encoded or resized copies of a photo change none, three lesions over 100
+MAX_CHANGED_PIXELS = int(os.environ.get("PALAY_DUPLICATE_MAX_CHANGED_PIXELS", "8"))
+# Closest candidates checked per lookup
+MAX_CANDIDATES = 5
+
+
+# ========== MULTI-INDEX HASHING ==========
+CHUNKS = 4
+CHUNK_BITS = 16
+_flip_masks = {}
+
+
+def flip_masks(radius):
+    """Every 16-bit mask with at most radius bits set"""
+    if radius not in _flip_masks:
+        masks = [0]
+        for bits in range(1, radius + 1):
+            masks += [sum(1 << bit for bit in combo) for combo in itertools.combinations(range(CHUNK_BITS), bits)]
+        _flip_masks[radius] = masks
+    return _flip_masks[radius]
+
+
+class MultiIndexHash:
+    """64-bit hashes split into four 16-bit chunks, each chunk indexed exactly
+
+    Two hashes within distance d differ by at most d // 4 bits in at least one chunk,
+    so a search probes each chunk table with the variants that close and compares
+    full hashes only for the few candidates found there.
+    """
+
+    def __init__(self):
+        self.tables = [{} for _ in range(CHUNKS)]
+        self.hashes = []
+        self.items = []
+
+    @property
+    def size(self):
+        return len(self.hashes)
+
+    @staticmethod
+    def chunks(hash_value):
+        return [(hash_value >> (CHUNK_BITS * i)) & 0xFFFF for i in range(CHUNKS)]
+
+    def add(self, hash_value, item):
+        position = len(self.hashes)
+        self.hashes.append(hash_value)
+        self.items.append(item)
+        for table, chunk in zip(self.tables, self.chunks(hash_value)):
+            table.setdefault(chunk, []).append(position)
+
+    def search(self, hash_value, max_distance):
+        """All (distance, item) within max_distance, closest first"""
+        masks = flip_masks(max_distance // CHUNKS)
+        candidates = set()
+        for table, chunk in zip(self.tables, self.chunks(hash_value)):
+            for mask in masks:
+                candidates.update(table.get(chunk ^ mask, ()))
+        matches = []
+        for position in candidates:
+            distance = image_pipeline.hamming(hash_value, self.hashes[position])
+            if distance <= max_distance:
+                matches.append((distance, self.items[position]))
+        return sorted(matches, key=lambda match: match[0])
+
+
+# ========== PERSISTENT INDEX ==========
+class DuplicateIndex:
+    """dHash of every scan per model and user, in multi-index hash tables loaded from scan_hashes
+
+    Only hashes and row ids are kept in memory. A candidate is confirmed by comparing
+    the new image with the candidate's photo in the scan image store, so scans whose
+    photo was not kept (healthy ones) are never reused. Results are only ever reused
+    between scans of the same user.
+    """
+
+    def __init__(self, db_path=database.DB_PATH, max_distance=NEAR_DUPLICATE_DISTANCE,
+                 max_changed_pixels=MAX_CHANGED_PIXELS, store=None):
+        self.db_path = db_path
+        self.store = store
+        self.max_distance = max_distance
+        self.max_changed_pixels = max_changed_pixels
+        self._tables = None
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "rejected": 0, "total_lookup_ms": 0.0}
+
+    def _load(self):
+        tables = {}
+        conn = database.connect(self.db_path)
+        cursor = conn.cursor()
+        # Rows from before reuse was limited to one user have no user and are never reused
+        cursor.execute("""
+            SELECT id, dhash, model_id, user_id FROM scan_hashes
+            WHERE user_id IS NOT NULL
+            ORDER BY id
+        """)
+        for row_id, dhash_hex, model_id, user_id in cursor.fetchall():
+            tables.setdefault((model_id, user_id), MultiIndexHash()).add(int(dhash_hex, 16), row_id)
+        conn.close()
+        return tables
+
+    def _confirm(self, candidates, image_bytes):
+        """First candidate whose stored photo matches image_bytes, as (image_hash, result, distance)"""
+        store = self.store or image_store.get_store()
+        conn = database.connect(self.db_path)
+        cursor = conn.cursor()
+        try:
+            for distance, row_id in candidates[:MAX_CANDIDATES]:
+                cursor.execute("SELECT image_hash, result FROM scan_hashes WHERE id = ?", (row_id,))
+                row = cursor.fetchone()
+                original = store.get(row[0]) if row else None
+                if original is not None and image_pipeline.pixel_changes(original, image_bytes) <= self.max_changed_pixels:
+                    return row[0], json.loads(row[1]), distance
+        finally:
+            conn.close()
+        return None
+
+    def lookup(self, dhash_value, image_bytes, model_id, user_id):
+        """Closest confirmed earlier scan by the same user as (image_hash, result, distance), or None"""
+        start = time.perf_counter()
+        with self._lock:
+            if self._tables is None:
+                self._tables = self._load()
+            table = self._tables.get((model_id, user_id))
+            candidates = table.search(dhash_value, self.max_distance) if table else []
+        match = self._confirm(candidates, image_bytes) if candidates else None
+        with self._lock:
+            self._stats["lookups"] += 1
+            self._stats["hits"] += 1 if match else 0
+            self._stats["rejected"] += 1 if candidates and not match else 0
+            self._stats["total_lookup_ms"] += (time.perf_counter() - start) * 1000
+        return match
+
+    def add(self, dhash_value, model_id, user_id, image_hash, result):
+        """Index a newly analysed scan so the same user's later re-scans can reuse its result"""
+        payload = json.dumps(result, separators=(",", ":"))
+        conn = database.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO scan_hashes (dhash, model_id, user_id, image_hash, result)
+            VALUES (?, ?, ?, ?, ?)
+        """, (f"{dhash_value:016x}", model_id, user_id, image_hash, payload))
+        row_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        with self._lock:
+            if self._tables is not None:
+                self._tables.setdefault((model_id, user_id), MultiIndexHash()).add(dhash_value, row_id)
+
+    def stats(self):
+        """Index size and hit counters for the admin dashboard"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["indexed"] = sum(table.size for table in self._tables.values()) if self._tables is not None else None
+        stats["avg_lookup_ms"] = stats["total_lookup_ms"] / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
+
+
+# ========== SHARED INSTANCE ==========
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Return the process-wide duplicate index, creating it on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DuplicateIndex()
+    return _index
@@ -0,0 +1,505 @@
+# ========== IMPORTS ==========
+import hashlib
+import io
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+# ========== CONFIGURATION ==========
+JPEG_QUALITY = 90
+
+# Native input size and upload quality per Roboflow model
+DEFAULT_MODEL_PROFILE = {"input_size": 640, "jpeg_quality": 85}
+MODEL_PROFILES = {
+    "palayprotector-project/1": {"input_size": 640, "jpeg_quality": 85},
+}
+
+# Detect page preview: long side in pixels and how many distinct uploads to remember
+PREVIEW_SIZE = 480
+PREVIEW_QUALITY = 75
+PREVIEW_CACHE_ENTRIES = 64
+
+# Tiling: photos are first capped to this size, then cut into model-sized tiles
+TILING_MAX_SIDE = 2560
+TILE_OVERLAP = 0.2
+
+# Video scanning: frames sampled per second, and how different a frame must be to count
+VIDEO_SAMPLE_FPS = 2
+KEYFRAME_HASH_DISTANCE = 10
+KEYFRAMES_PER_MINUTE = 20
+MAX_KEYFRAMES = 60
+
+# Near-duplicate confirmation: both photos are compared at this size in Lab colour, and a
+# pixel counts as changed when a channel moves further than this (brown lesions on a
+# green leaf barely change brightness, but shift a* and b* strongly)
+COMPARE_SIZE = 256
+COMPARE_PIXEL_DIFF = 20
+# Pixels a feature may move between the two compared photos, e.g. when the leaf crop shifts
+COMPARE_SHIFT = 3
+
+# Quality gate thresholds (Laplacian variance, mean brightness 0-255, clipped pixel
+# fraction, fraction of leaf-coloured pixels)
+BLUR_REJECT = 15.0
+BLUR_WARN = 60.0
+DARK_REJECT = 35.0
+DARK_WARN = 60.0
+CLIPPED_REJECT = 0.6
+LEAF_REJECT = 0.02
+LEAF_WARN = 0.10
+
+# Leaf cropping: leaf blobs smaller than ROI_MIN_AREA of the frame are ignored, the
+# crop is padded by ROI_PADDING per side, and frames the leaf nearly fills are sent whole
+ROI_MIN_AREA = 0.01
+ROI_PADDING = 0.05
+ROI_MAX_FRACTION = 0.85
+
+
+# ========== DECODE / ENCODE ==========
+def load_image(source):
+    """Decode an uploaded file, camera photo or raw bytes into an RGB PIL image"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+
+def encode_jpeg(image, quality=JPEG_QUALITY):
+    """Encode a PIL image or RGB numpy array to JPEG bytes in memory"""
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+# ========== PREPROCESSING ==========
+def get_model_profile(model_id):
+    """Preprocessing settings for a model, falling back to the defaults"""
+    return {**DEFAULT_MODEL_PROFILE, **MODEL_PROFILES.get(model_id, {})}
+
+
+def find_leaf_roi(image, min_area=ROI_MIN_AREA, padding=ROI_PADDING, max_fraction=ROI_MAX_FRACTION):
+    """Bounding box (left, top, right, bottom) around the leaf regions of an RGB image
+
+    Uses the same leaf hue range as the quality gate. Returns None when no leaf is
+    found or the leaf already fills most of the frame, meaning send the whole frame.
+    """
+    pixels = np.asarray(image)
+    height, width = pixels.shape[:2]
+    hsv = cv2.cvtColor(pixels, cv2.COLOR_RGB2HSV)
+    mask = cv2.inRange(hsv, (20, 40, 40), (95, 255, 255))
+    # Close gaps from lesions and veins, then drop speckle from grass and soil
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (9, 9))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    rects = [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) >= min_area * width * height]
+    if not rects:
+        return None
+    rects = np.array(rects)
+    left, top = rects[:, 0].min(), rects[:, 1].min()
+    right, bottom = (rects[:, 0] + rects[:, 2]).max(), (rects[:, 1] + rects[:, 3]).max()
+
+    pad_x, pad_y = int(width * padding), int(height * padding)
+    left, top = max(int(left) - pad_x, 0), max(int(top) - pad_y, 0)
+    right, bottom = min(int(right) + pad_x, width), min(int(bottom) + pad_y, height)
+    if (right - left) * (bottom - top) > max_fraction * width * height:
+        return None
+    return left, top, right, bottom
+
+
+def preprocess(raw_bytes, model_id, crop_leaf=True):
+    """Fix EXIF rotation, shrink to the model input size, crop to the leaf and re-encode for upload
+
+    Returns the JPEG bytes to send and a report with the before/after sizes. With
+    crop_leaf the report also carries the leaf box ("roi", None for the full frame),
+    the upload bytes the crop saved and the time it took.
+    """
+    start = time.perf_counter()
+    profile = get_model_profile(model_id)
+    input_size = profile["input_size"]
+
+    image = Image.open(io.BytesIO(raw_bytes))
+    original_size = image.size
+    # Let the JPEG decoder skip detail we are about to throw away
+    image.draft("RGB", (input_size, input_size))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max(image.size) > input_size:
+        image.thumbnail((input_size, input_size), resample=Image.BILINEAR, reducing_gap=2.0)
+
+    roi = None
+    roi_ms = 0.0
+    frame_size = image.size
+    image_bytes = encode_jpeg(image, quality=profile["jpeg_quality"])
+    full_frame_bytes = len(image_bytes)
+    if crop_leaf:
+        roi_start = time.perf_counter()
+        roi = find_leaf_roi(image)
+        if roi:
+            image = image.crop(roi)
+            image_bytes = encode_jpeg(image, quality=profile["jpeg_quality"])
+        roi_ms = (time.perf_counter() - roi_start) * 1000
+
+    roi_fraction = (image.size[0] * image.size[1]) / (frame_size[0] * frame_size[1])
+    report = {
+        "model_id": model_id,
+        "original_bytes": len(raw_bytes),
+        "processed_bytes": len(image_bytes),
+        "original_size": original_size,
+        "processed_size": image.size,
+        "roi": roi,
+        "roi_fraction": roi_fraction,
+        "roi_bytes_saved": full_frame_bytes - len(image_bytes),
+        "roi_ms": roi_ms,
+        "preprocess_ms": (time.perf_counter() - start) * 1000,
+    }
+    with _roi_lock:
+        _roi_stats["scans"] += 1
+        _roi_stats["cropped"] += 1 if roi else 0
+        _roi_stats["bytes_saved"] += report["roi_bytes_saved"]
+        _roi_stats["total_ms"] += roi_ms
+    return image_bytes, report
+
+
+_roi_stats = {"scans": 0, "cropped": 0, "bytes_saved": 0, "total_ms": 0.0}
+_roi_lock = threading.Lock()
+
+
+def leaf_crop_stats():
+    """Leaf cropping counters for the admin dashboard"""
+    with _roi_lock:
+        stats = dict(_roi_stats)
+    stats["avg_ms"] = stats["total_ms"] / stats["scans"] if stats["scans"] else 0.0
+    return stats
+
+
+# ========== PREVIEW ==========
+_preview_cache = OrderedDict()
+_preview_lock = threading.Lock()
+
+
+def make_preview(raw_bytes, digest=None, size=PREVIEW_SIZE):
+    """Small WebP of an upload for the detect page, made once per distinct photo
+
+    Memoized by content hash, so reruns cost a dictionary lookup and the preview
+    payload stays a few tens of KB however large the original photo is.
+    """
+    digest = digest or hashlib.sha256(raw_bytes).hexdigest()
+    with _preview_lock:
+        preview = _preview_cache.get(digest)
+        if preview is not None:
+            _preview_cache.move_to_end(digest)
+            return preview
+
+    image = Image.open(io.BytesIO(raw_bytes))
+    image.draft("RGB", (size, size))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((size, size), resample=Image.BILINEAR, reducing_gap=2.0)
+    buffered = io.BytesIO()
+    image.save(buffered, format="WEBP", quality=PREVIEW_QUALITY)
+    preview = buffered.getvalue()
+
+    with _preview_lock:
+        _preview_cache[digest] = preview
+        while len(_preview_cache) > PREVIEW_CACHE_ENTRIES:
+            _preview_cache.popitem(last=False)
+    return preview
+
+
+# ========== TILING ==========
+def _tile_starts(length, tile_size, step):
+    starts = list(range(0, max(length - tile_size, 0) + 1, step))
+    if starts[-1] + tile_size < length:
+        starts.append(length - tile_size)
+    return starts
+
+
+def make_tiles(raw_bytes, model_id, max_side=TILING_MAX_SIDE, overlap=TILE_OVERLAP):
+    """Cut a large photo into overlapping model-sized JPEG tiles
+
+    Returns (tiles, offsets, scale, size): offsets are each tile's top-left corner in
+    the capped image, and scale maps those pixels back to the EXIF-corrected photo.
+    """
+    profile = get_model_profile(model_id)
+    tile_size = profile["input_size"]
+
+    image = Image.open(io.BytesIO(raw_bytes))
+    original_size = image.size
+    # EXIF orientations 5-8 rotate by 90 degrees
+    if image.getexif().get(0x0112) in (5, 6, 7, 8):
+        original_size = original_size[::-1]
+    image.draft("RGB", (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), resample=Image.BILINEAR, reducing_gap=2.0)
+    scale = original_size[0] / image.size[0]
+
+    step = max(int(tile_size * (1 - overlap)), 1)
+    width, height = image.size
+    tiles = []
+    offsets = []
+    for top in _tile_starts(height, tile_size, step):
+        for left in _tile_starts(width, tile_size, step):
+            tile = image.crop((left, top, min(left + tile_size, width), min(top + tile_size, height)))
+            tiles.append(encode_jpeg(tile, quality=profile["jpeg_quality"]))
+            offsets.append((left, top))
+    return tiles, offsets, scale, original_size
+
+
+def needs_tiling(size, model_id):
+    """Only photos well above the model input size gain from tiling"""
+    return max(size) > 2 * get_model_profile(model_id)["input_size"]
+
+
+# ========== PERCEPTUAL HASH ==========
+def dhash(gray, hash_size=8):
+    """64-bit difference hash of a grayscale image array"""
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def image_dhash(image_bytes):
+    """dHash straight from encoded image bytes, decoding at reduced size"""
+    gray = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if gray is None:
+        raise ValueError("Could not decode image")
+    return dhash(gray)
+
+
+def hamming(hash_a, hash_b):
+    """Number of differing bits between two hashes"""
+    return bin(hash_a ^ hash_b).count("1")
+
+
+def _lab_thumbnail(image_bytes, size):
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+    small = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+    lab = cv2.cvtColor(small, cv2.COLOR_BGR2LAB).astype(np.float32)
+    # Centre each channel so a slightly brighter re-take does not count as a change
+    return lab - lab.reshape(-1, 3).mean(axis=0)
+
+
+def _outside_neighbourhood(lab, other, pixel_diff):
+    # A pixel only counts if no pixel near the same spot in the other image comes close,
+    # so a leaf crop that moved by a pixel or two is not mistaken for a change
+    kernel = np.ones((2 * COMPARE_SHIFT + 1, 2 * COMPARE_SHIFT + 1), np.uint8)
+    excess = np.maximum(lab - cv2.dilate(other, kernel), cv2.erode(other, kernel) - lab)
+    return int(np.count_nonzero(excess.max(axis=2) > pixel_diff))
+
+
+def pixel_changes(image_a, image_b, size=COMPARE_SIZE, pixel_diff=COMPARE_PIXEL_DIFF):
+    """Pixels that differ between two encoded images, compared at size x size in Lab colour
+
+    Re-encoded, resized or slightly re-cropped copies of a photo change almost none;
+    a few lesions change a hundred or more.
+    """
+    lab_a = _lab_thumbnail(image_a, size)
+    lab_b = _lab_thumbnail(image_b, size)
+    return max(_outside_neighbourhood(lab_a, lab_b, pixel_diff), _outside_neighbourhood(lab_b, lab_a, pixel_diff))
+
+
+# ========== VIDEO KEYFRAMES ==========
+def extract_keyframes(video_path, model_id, sample_fps=VIDEO_SAMPLE_FPS,
+                      min_distance=KEYFRAME_HASH_DISTANCE, per_minute=KEYFRAMES_PER_MINUTE,
+                      max_keyframes=MAX_KEYFRAMES):
+    """Pick visually distinct frames from a walk-through video as model-sized JPEGs
+
+    The keyframe budget (per_minute of video, at most max_keyframes) splits the video
+    into that many equal time buckets, so keyframes cover the whole walk. Frames are
+    sampled at sample_fps; each bucket keeps the sampled frame whose dHash is furthest
+    from the previous keyframe, and nothing if even that one is within min_distance bits.
+
+    Returns (keyframes, report) where keyframes are (timestamp_seconds, jpeg_bytes).
+    """
+    start = time.perf_counter()
+    profile = get_model_profile(model_id)
+
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError("Could not open video")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    duration = frame_count / fps if frame_count else 0.0
+    if duration:
+        budget = min(max_keyframes, max(1, math.ceil(duration / 60 * per_minute)))
+        bucket_seconds = duration / budget
+    else:
+        # Unknown length (some containers don't say): fall back to the per-minute pace
+        budget = max_keyframes
+        bucket_seconds = 60 / per_minute
+    frame_step = max(int(round(fps / sample_fps)), 1)
+
+    keyframes = []
+    last_hash = None
+    best = None  # (distance, timestamp, frame, frame_hash) of the current bucket
+    bucket = 0
+    sampled = 0
+    near_duplicates = 0
+    frame_index = 0
+
+    def keep_best():
+        nonlocal last_hash, near_duplicates
+        distance, timestamp, frame, frame_hash = best
+        if last_hash is not None and distance <= min_distance:
+            near_duplicates += 1
+            return
+        last_hash = frame_hash
+        encoded = _encode_keyframe(frame, profile)
+        if encoded is not None:
+            keyframes.append((timestamp, encoded))
+
+    try:
+        while True:
+            # grab() skips frames without converting them; only sampled frames are retrieved
+            if not capture.grab():
+                break
+            if frame_index % frame_step:
+                frame_index += 1
+                continue
+            ok, frame = capture.retrieve()
+            timestamp = frame_index / fps
+            frame_index += 1
+            if not ok:
+                break
+            sampled += 1
+
+            frame_bucket = int(timestamp / bucket_seconds)
+            if duration:
+                # Frame counts are estimates; late frames belong to the last bucket
+                frame_bucket = min(frame_bucket, budget - 1)
+            if frame_bucket != bucket and best is not None:
+                keep_best()
+                best = None
+            if frame_bucket >= budget:
+                break
+            bucket = frame_bucket
+
+            frame_hash = dhash(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            distance = hamming(frame_hash, last_hash) if last_hash is not None else 0
+            if best is None or distance > best[0]:
+                best = (distance, timestamp, frame, frame_hash)
+        if best is not None:
+            keep_best()
+    finally:
+        capture.release()
+
+    report = {
+        "duration_seconds": duration,
+        "frames_sampled": sampled,
+        "keyframes": len(keyframes),
+        "keyframe_budget": budget,
+        "near_duplicates": near_duplicates,
+        "extract_ms": (time.perf_counter() - start) * 1000,
+    }
+    return keyframes, report
+
+
+def _encode_keyframe(frame, profile):
+    """Shrink a frame to the model input size and encode it; None if encoding fails"""
+    input_size = profile["input_size"]
+    height, width = frame.shape[:2]
+    ratio = input_size / max(height, width)
+    if ratio < 1:
+        frame = cv2.resize(frame, (int(width * ratio), int(height * ratio)), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, profile["jpeg_quality"]])
+    return encoded.tobytes() if ok else None
+
+
+# ========== QUALITY GATE ==========
+class QualityRejected(Exception):
+    """Raised when a photo is too poor to be worth an inference call"""
+
+
+_gate_stats = {"checked": 0, "rejected": 0, "warned": 0, "total_ms": 0.0, "reasons": {}}
+_gate_lock = threading.Lock()
+
+
+def quality_gate(image_bytes):
+    """Check blur, exposure and leaf presence on a (preprocessed) JPEG in a few milliseconds
+
+    Returns {"passed", "rejections", "warnings", "metrics", "gate_ms"}.
+    """
+    start = time.perf_counter()
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel() / gray.size
+    brightness = float(np.dot(histogram, np.arange(256)))
+    clipped = float(histogram[:8].sum() + histogram[248:].sum())
+
+    # Green to yellow-brown hues with some saturation: healthy and diseased leaf tissue
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    leaf_mask = cv2.inRange(hsv, (20, 40, 40), (95, 255, 255))
+    leaf_ratio = float(cv2.countNonZero(leaf_mask)) / leaf_mask.size
+
+    # reason code -> message shown to the farmer
+    rejections = {}
+    warnings = []
+    if sharpness < BLUR_REJECT:
+        rejections["blurry"] = "The photo is too blurry. Hold the camera steady and focus on the leaf."
+    elif sharpness < BLUR_WARN:
+        warnings.append("The photo is slightly blurry; results may be less accurate.")
+    if brightness < DARK_REJECT:
+        rejections["dark"] = "The photo is too dark. Take it in daylight."
+    elif brightness < DARK_WARN:
+        warnings.append("The photo is quite dark; results may be less accurate.")
+    if clipped > CLIPPED_REJECT:
+        rejections["exposure"] = "The photo is over- or under-exposed. Avoid direct sunlight on the lens."
+    if leaf_ratio < LEAF_REJECT:
+        rejections["no_leaf"] = "No rice leaf was found. Fill the frame with the leaf."
+    elif leaf_ratio < LEAF_WARN:
+        warnings.append("The leaf covers only a small part of the photo. Move closer for better results.")
+
+    gate_ms = (time.perf_counter() - start) * 1000
+    with _gate_lock:
+        _gate_stats["checked"] += 1
+        _gate_stats["total_ms"] += gate_ms
+        if rejections:
+            _gate_stats["rejected"] += 1
+            for reason in rejections:
+                _gate_stats["reasons"][reason] = _gate_stats["reasons"].get(reason, 0) + 1
+        elif warnings:
+            _gate_stats["warned"] += 1
+
+    return {
+        "passed": not rejections,
+        "rejections": list(rejections.values()),
+        "warnings": warnings,
+        "metrics": {
+            "sharpness": sharpness,
+            "brightness": brightness,
+            "clipped": clipped,
+            "leaf_ratio": leaf_ratio,
+        },
+        "gate_ms": gate_ms,
+    }
+
+
+def quality_gate_stats():
+    """Gate counters for the admin dashboard; every rejection is one inference call saved"""
+    with _gate_lock:
+        stats = dict(_gate_stats, reasons=dict(_gate_stats["reasons"]))
+    stats["avg_ms"] = stats["total_ms"] / stats["checked"] if stats["checked"] else 0.0
+    return stats
@@ -0,0 +1,138 @@
+# ========== IMPORTS ==========
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import threading
+
+from PIL import Image, ImageOps
+
+# ========== CONFIGURATION ==========
+STORE_DIR = os.environ.get("PALAY_IMAGE_STORE", "scan_images")
+THUMBNAIL_SIZE = int(os.environ.get("PALAY_THUMBNAIL_SIZE", "160"))
+THUMBNAIL_QUALITY = 70
+
+
+def content_hash(image_bytes):
+    """Address an image by the SHA-256 of its bytes"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+# ========== CONTENT-ADDRESSED STORE ==========
+class ImageStore:
+    """Scanned images on disk, one file per distinct image, each with a WebP thumbnail
+
+    Files live at <root>/<first two hex digits>/<sha256> with the thumbnail next to
+    it as <sha256>.webp, so the same photo scanned twice is stored once.
+    """
+
+    def __init__(self, root=STORE_DIR, thumbnail_size=THUMBNAIL_SIZE, thumbnail_quality=THUMBNAIL_QUALITY):
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_quality = thumbnail_quality
+        self._lock = threading.Lock()
+        self._stats = {"writes": 0, "duplicates": 0, "bytes_written": 0}
+
+    def image_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def thumbnail_path(self, digest):
+        return self.image_path(digest) + ".webp"
+
+    def put(self, image_bytes):
+        """Store an image and its thumbnail unless already present; returns the content hash"""
+        digest = content_hash(image_bytes)
+        if os.path.exists(self.thumbnail_path(digest)):
+            with self._lock:
+                self._stats["duplicates"] += 1
+            return digest
+
+        thumbnail = self.make_thumbnail(image_bytes)
+        os.makedirs(os.path.dirname(self.image_path(digest)), exist_ok=True)
+        # The thumbnail is written last, so its presence means the entry is complete
+        self._write_atomic(self.image_path(digest), image_bytes)
+        self._write_atomic(self.thumbnail_path(digest), thumbnail)
+        with self._lock:
+            self._stats["writes"] += 1
+            self._stats["bytes_written"] += len(image_bytes) + len(thumbnail)
+        return digest
+
+    def make_thumbnail(self, image_bytes):
+        """Small WebP rendition of an image, made once at write time"""
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft("RGB", (self.thumbnail_size, self.thumbnail_size))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((self.thumbnail_size, self.thumbnail_size), resample=Image.BILINEAR, reducing_gap=2.0)
+        buffered = io.BytesIO()
+        image.save(buffered, format="WEBP", quality=self.thumbnail_quality)
+        return buffered.getvalue()
+
+    def _write_atomic(self, path, data):
+        # Concurrent writers of the same content race harmlessly: both rename identical files
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def get(self, digest):
+        """Original image bytes for a hash, or None if it is not stored"""
+        try:
+            with open(self.image_path(digest), "rb") as f:
+                return f.read()
+        except (FileNotFoundError, TypeError):
+            return None
+
+    def thumbnail(self, digest):
+        """WebP thumbnail bytes for a hash, or None if it is not stored"""
+        try:
+            with open(self.thumbnail_path(digest), "rb") as f:
+                return f.read()
+        except (FileNotFoundError, TypeError):
+            return None
+
+    def thumbnail_data_uri(self, digest):
+        """Thumbnail as a data: URI for inline <img> tags and image columns"""
+        thumbnail = self.thumbnail(digest) if digest else None
+        if thumbnail is None:
+            return None
+        return "data:image/webp;base64," + base64.b64encode(thumbnail).decode()
+
+    def stats(self):
+        """Write/dedup counters for this process; cheap enough for every dashboard render"""
+        with self._lock:
+            return dict(self._stats)
+
+    def disk_usage(self):
+        """Images and bytes on disk; walks the whole store, so only run it on request"""
+        images = 0
+        disk_bytes = 0
+        if os.path.isdir(self.root):
+            for directory, _, files in os.walk(self.root):
+                for name in files:
+                    if not name.endswith(".tmp"):
+                        disk_bytes += os.path.getsize(os.path.join(directory, name))
+                        images += not name.endswith(".webp")
+        return {"images": images, "disk_bytes": disk_bytes}
+
+
+# ========== SHARED INSTANCE ==========
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the process-wide image store, creating it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ImageStore()
+    return _store
@@ -0,0 +1,481 @@
+# ========== IMPORTS ==========
+import base64
+import os
+import random
+import socket
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+import image_pipeline
+
+# ========== CONFIGURATION ==========
+# "roboflow" for the hosted serverless API, "local" for the on-device OpenCV engine,
+# "mock" for mock_inference_server.py
+BACKEND = os.environ.get("PALAY_INFERENCE_BACKEND", "roboflow")
+MOCK_API_URL = os.environ.get("PALAY_MOCK_API_URL", "http://127.0.0.1:9001")
+
+API_URL = os.environ.get("PALAY_INFERENCE_API_URL", "https://serverless.roboflow.com")
+API_KEY = os.environ.get("PALAY_INFERENCE_API_KEY", "KajReyLpzYwgJ8fJ8sVd")
+MODEL_ID = os.environ.get("PALAY_MODEL_ID", "palayprotector-project/1")
+
+# Max open connections kept per host, shared by every session/thread
+POOL_SIZE = int(os.environ.get("PALAY_INFERENCE_POOL_SIZE", "10"))
+# Idle seconds before pooled connections are dropped and re-opened
+KEEP_ALIVE_SECONDS = int(os.environ.get("PALAY_INFERENCE_KEEP_ALIVE", "60"))
+REQUEST_TIMEOUT = float(os.environ.get("PALAY_INFERENCE_TIMEOUT", "30"))
+
+# Local engine: exported YOLO ONNX model plus one class name per line
+LOCAL_MODEL_PATH = os.environ.get("PALAY_LOCAL_MODEL", "models/palayprotector.onnx")
+LOCAL_LABELS_PATH = os.environ.get("PALAY_LOCAL_LABELS", "models/palayprotector.names")
+LOCAL_THREADS = int(os.environ.get("PALAY_LOCAL_THREADS", str(os.cpu_count() or 1)))
+LOCAL_CONFIDENCE = float(os.environ.get("PALAY_LOCAL_CONFIDENCE", "0.4"))
+LOCAL_NMS_IOU = float(os.environ.get("PALAY_LOCAL_NMS_IOU", "0.45"))
+
+# Resilience: total deadline per detection, retries for transient failures, circuit breaker
+DEADLINE_SECONDS = float(os.environ.get("PALAY_INFERENCE_DEADLINE", "45"))
+MAX_RETRIES = int(os.environ.get("PALAY_INFERENCE_RETRIES", "2"))
+RETRY_BASE_SECONDS = float(os.environ.get("PALAY_INFERENCE_RETRY_BASE", "0.5"))
+RETRY_CAP_SECONDS = float(os.environ.get("PALAY_INFERENCE_RETRY_CAP", "8"))
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+BREAKER_WINDOW = int(os.environ.get("PALAY_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.environ.get("PALAY_BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.environ.get("PALAY_BREAKER_ERROR_RATE", "0.5"))
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get("PALAY_BREAKER_COOLDOWN", "30"))
+# Backend to answer with while the breaker is open ("" to fail fast, or "local")
+FALLBACK_BACKEND = os.environ.get("PALAY_FALLBACK_BACKEND", "")
+
+
+# ========== BACKEND INTERFACE ==========
+class InferenceBackend:
+    """Common interface for detection backends
+
+    infer() returns {"predictions": [{"class", "confidence", "x", "y", "width", "height"}]}
+    with box centers and sizes in input image pixels, like the Roboflow API.
+    """
+
+    name = "base"
+
+    def infer(self, inference_input, model_id=MODEL_ID, timeout=None):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"backend": self.name}
+
+
+# ========== POOLED HTTP CLIENT ==========
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTP adapter that enables TCP keep-alive on pooled sockets"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        super().init_poolmanager(*args, **kwargs)
+
+
+class PooledInferenceClient(InferenceBackend):
+    """Roboflow v0 inference client that reuses HTTP connections across calls"""
+
+    name = "roboflow"
+
+    def __init__(self, api_url=API_URL, api_key=API_KEY,
+                 pool_size=POOL_SIZE, keep_alive=KEEP_ALIVE_SECONDS, timeout=REQUEST_TIMEOUT):
+        self.api_url = api_url.rstrip("/")
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+
+        self._adapter = KeepAliveAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=False)
+        self._session = requests.Session()
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+        self._session.headers.update({
+            "Connection": "keep-alive",
+            "Keep-Alive": f"timeout={keep_alive}",
+        })
+
+        self._lock = threading.Lock()
+        self._last_used = time.monotonic()
+        self._calls = 0
+        self._idle_resets = 0
+        # Counters from pools already cleared by an idle reset
+        self._retired_requests = 0
+        self._retired_connections = 0
+
+    def infer(self, inference_input, model_id=MODEL_ID, timeout=None):
+        """Run detection on encoded bytes, a PIL image, an RGB array or a file path"""
+        payload = base64.b64encode(encode_input(inference_input))
+
+        project, version = model_id.split("/")
+        self._recycle_if_idle()
+
+        response = self._session.post(
+            f"{self.api_url}/{project}/{version}",
+            params={"api_key": self.api_key},
+            data=payload,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            timeout=min(self.timeout, timeout) if timeout else self.timeout,
+        )
+        response.raise_for_status()
+
+        with self._lock:
+            self._calls += 1
+            self._last_used = time.monotonic()
+        return response.json()
+
+    def _recycle_if_idle(self):
+        """Drop pooled sockets the server has most likely closed already"""
+        with self._lock:
+            if time.monotonic() - self._last_used <= self.keep_alive:
+                return
+            requests_done, connections = self._pool_counters()
+            self._retired_requests += requests_done
+            self._retired_connections += connections
+            self._adapter.poolmanager.clear()
+            self._idle_resets += 1
+            self._last_used = time.monotonic()
+
+    def _pool_counters(self):
+        pools = self._adapter.poolmanager.pools
+        requests_done = connections = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                requests_done += pool.num_requests
+                connections += pool.num_connections
+        return requests_done, connections
+
+    def stats(self):
+        """Connection-reuse counters for the admin dashboard"""
+        with self._lock:
+            requests_done, connections = self._pool_counters()
+            requests_done += self._retired_requests
+            connections += self._retired_connections
+            return {
+                "backend": self.name,
+                "calls": self._calls,
+                "http_requests": requests_done,
+                "connections_opened": connections,
+                "connections_reused": max(requests_done - connections, 0),
+                "reuse_ratio": (requests_done - connections) / requests_done if requests_done else 0.0,
+                "idle_resets": self._idle_resets,
+                "pool_size": self.pool_size,
+                "keep_alive": self.keep_alive,
+            }
+
+
+# ========== LOCAL CPU ENGINE ==========
+class LocalInferenceEngine(InferenceBackend):
+    """Runs an exported YOLO ONNX model on the CPU through OpenCV DNN"""
+
+    name = "local"
+
+    def __init__(self, model_path=LOCAL_MODEL_PATH, labels_path=LOCAL_LABELS_PATH, threads=LOCAL_THREADS,
+                 confidence=LOCAL_CONFIDENCE, nms_iou=LOCAL_NMS_IOU):
+        cv2.setNumThreads(threads)
+        self.threads = threads
+        self.confidence = confidence
+        self.nms_iou = nms_iou
+        self._net = cv2.dnn.readNetFromONNX(model_path)
+        self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        with open(labels_path) as f:
+            self.labels = [line.strip() for line in f if line.strip()]
+
+        # cv2.dnn.Net is not thread-safe; parallelism comes from OpenCV's own threads
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._total_ms = 0.0
+
+    def infer(self, inference_input, model_id=MODEL_ID, timeout=None):
+        """Run detection locally and return Roboflow-shaped predictions"""
+        start = time.perf_counter()
+        encoded = np.frombuffer(encode_input(inference_input), dtype=np.uint8)
+        image = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not decode image for local inference")
+
+        input_size = image_pipeline.get_model_profile(model_id)["input_size"]
+        blob = cv2.dnn.blobFromImage(image, 1 / 255.0, (input_size, input_size), swapRB=True, crop=False)
+        with self._lock:
+            self._net.setInput(blob)
+            output = self._net.forward()
+
+        height, width = image.shape[:2]
+        predictions = self._parse_output(output, width / input_size, height / input_size)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._calls += 1
+            self._total_ms += elapsed_ms
+        return {
+            "predictions": predictions,
+            "image": {"width": width, "height": height},
+            "time": elapsed_ms / 1000,
+        }
+
+    def _parse_output(self, output, scale_x, scale_y):
+        """Decode YOLOv8 (1, 4+classes, N) or YOLOv5 (1, N, 5+classes) output"""
+        rows = output[0]
+        if rows.shape[0] < rows.shape[1]:
+            rows = rows.T
+        if rows.shape[1] == 4 + len(self.labels):
+            scores = rows[:, 4:]
+        else:
+            scores = rows[:, 5:] * rows[:, 4:5]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences >= self.confidence
+        rows, class_ids, confidences = rows[keep], class_ids[keep], confidences[keep]
+        if not len(rows):
+            return []
+
+        boxes = rows[:, :4] * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        top_left = np.column_stack([boxes[:, 0] - boxes[:, 2] / 2, boxes[:, 1] - boxes[:, 3] / 2, boxes[:, 2], boxes[:, 3]])
+        kept = cv2.dnn.NMSBoxes(top_left.tolist(), confidences.tolist(), self.confidence, self.nms_iou)
+        return [
+            {
+                "x": float(boxes[i, 0]),
+                "y": float(boxes[i, 1]),
+                "width": float(boxes[i, 2]),
+                "height": float(boxes[i, 3]),
+                "confidence": float(confidences[i]),
+                "class": self.labels[class_ids[i]],
+                "class_id": int(class_ids[i]),
+            }
+            for i in np.array(kept).flatten()
+        ]
+
+    def stats(self):
+        """Call counts and average latency for the admin dashboard"""
+        with self._lock:
+            return {
+                "backend": self.name,
+                "calls": self._calls,
+                "avg_ms": self._total_ms / self._calls if self._calls else 0.0,
+                "threads": self.threads,
+            }
+
+
+# ========== RESILIENCE ==========
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that is currently failing"""
+
+
+def is_retryable(error):
+    """Connection problems, timeouts and 408/429/5xx responses are worth retrying"""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRYABLE_STATUS
+    return False
+
+
+def describe_error(error):
+    """User-facing message for an inference failure (never echoes URLs or keys)"""
+    if isinstance(error, CircuitOpenError):
+        return str(error)
+    if isinstance(error, requests.Timeout):
+        return "The detection service took too long to respond. Please try again."
+    if is_retryable(error):
+        return "The detection service is temporarily unavailable. Please try again."
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return f"The detection service rejected the image (HTTP {error.response.status_code})."
+    return str(error)
+
+
+class CircuitBreaker:
+    """Opens when the recent upstream error rate spikes, then probes after a cooldown"""
+
+    def __init__(self, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 error_rate=BREAKER_ERROR_RATE, cooldown=BREAKER_COOLDOWN_SECONDS):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.times_opened = 0
+
+    def allow(self):
+        """Whether a call may go upstream right now"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "closed"
+                self._outcomes.clear()
+            self._outcomes.append(True)
+
+    def release_probe(self):
+        """The upstream answered but the call failed for our own reasons (bad input);
+        a half-open probe proves it is reachable, so close again"""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "closed"
+                self._outcomes.clear()
+
+    def record_failure(self):
+        with self._lock:
+            self._outcomes.append(False)
+            if self.state == "half_open":
+                self._open()
+            elif self.state == "closed" and len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.error_rate:
+                    self._open()
+
+    def _open(self):
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self.times_opened += 1
+
+    def stats(self):
+        with self._lock:
+            failures = self._outcomes.count(False)
+            return {
+                "state": self.state,
+                "window_calls": len(self._outcomes),
+                "window_error_rate": failures / len(self._outcomes) if self._outcomes else 0.0,
+                "times_opened": self.times_opened,
+            }
+
+
+class ResilientBackend(InferenceBackend):
+    """Wraps a backend with a per-call deadline, jittered retries and a circuit breaker"""
+
+    def __init__(self, backend, fallback=None, deadline=DEADLINE_SECONDS, max_retries=MAX_RETRIES,
+                 retry_base=RETRY_BASE_SECONDS, retry_cap=RETRY_CAP_SECONDS, breaker=None):
+        self.backend = backend
+        self.fallback = fallback
+        self.name = backend.name
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._counters = {"retries": 0, "failures": 0, "short_circuited": 0, "fallbacks": 0, "deadline_exceeded": 0}
+
+    def infer(self, inference_input, model_id=MODEL_ID, timeout=None):
+        """Call the backend, retrying transient failures until the deadline runs out"""
+        deadline = time.monotonic() + min(self.deadline, timeout or self.deadline)
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count("short_circuited")
+                return self._fall_back(inference_input, model_id, CircuitOpenError(
+                    "The detection service is having trouble right now. Please try again in a minute."
+                ))
+
+            try:
+                result = self.backend.infer(inference_input, model_id=model_id,
+                                            timeout=max(deadline - time.monotonic(), 0.1))
+            except Exception as e:
+                if not is_retryable(e):
+                    # Bad input or credentials; the upstream itself is fine
+                    self.breaker.release_probe()
+                    raise
+                self.breaker.record_failure()
+                self._count("failures")
+                delay = random.uniform(0, min(self.retry_cap, self.retry_base * 2 ** attempt))
+                if attempt >= self.max_retries:
+                    return self._fall_back(inference_input, model_id, e)
+                if time.monotonic() + delay >= deadline:
+                    self._count("deadline_exceeded")
+                    return self._fall_back(inference_input, model_id, e)
+                attempt += 1
+                self._count("retries")
+                time.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    def _fall_back(self, inference_input, model_id, error):
+        if self.fallback is None:
+            raise error
+        self._count("fallbacks")
+        return self.fallback.infer(inference_input, model_id=model_id)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        """Backend stats plus breaker state and retry counters"""
+        stats = self.backend.stats()
+        with self._lock:
+            stats["resilience"] = dict(self._counters)
+        stats["breaker"] = self.breaker.stats()
+        stats["fallback"] = self.fallback.name if self.fallback else None
+        return stats
+
+
+def encode_input(inference_input):
+    """Turn any supported inference input into encoded image bytes without touching disk"""
+    if isinstance(inference_input, (bytes, bytearray)):
+        return bytes(inference_input)
+    if isinstance(inference_input, str):
+        with open(inference_input, "rb") as f:
+            return f.read()
+    return image_pipeline.encode_jpeg(inference_input)
+
+
+# ========== SHARED INSTANCE ==========
+_client = None
+_client_lock = threading.Lock()
+
+
+def create_resilient_backend(backend=BACKEND, fallback=FALLBACK_BACKEND):
+    """Build the configured backend wrapped in deadlines, retries and a circuit breaker"""
+    fallback_backend = None
+    if fallback and fallback != backend:
+        try:
+            fallback_backend = create_backend(fallback)
+        except Exception as e:
+            print(f"Fallback inference backend '{fallback}' unavailable: {e}")
+    return ResilientBackend(create_backend(backend), fallback=fallback_backend)
+
+
+def create_backend(backend=BACKEND):
+    """Build the configured inference backend"""
+    if backend == "local":
+        return LocalInferenceEngine()
+    if backend == "roboflow":
+        return PooledInferenceClient()
+    if backend == "mock":
+        client = PooledInferenceClient(api_url=MOCK_API_URL)
+        client.name = "mock"
+        return client
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+
+def get_client():
+    """Return the process-wide inference backend, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_resilient_backend()
+    return _client
@@ -0,0 +1,304 @@
+"""Versioned, reversible schema migrations for users.db.
+
+Each migration has a version, a name and lists of up/down steps (SQL strings or
+callables taking a cursor). Applied versions are recorded in schema_migrations.
+The early migrations are idempotent so databases created before the runner
+existed are adopted without changes.
+
+    python migrations.py status
+    python migrations.py up [VERSION]
+    python migrations.py down VERSION
+"""
+
+# ========== IMPORTS ==========
+import argparse
+import threading
+import time
+from collections import namedtuple
+
+import database
+import rollups
+import user_stats
+
+Migration = namedtuple("Migration", ["version", "name", "up", "down"])
+
+
+# ========== STEP HELPERS ==========
+def column_exists(cursor, table, column):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+def add_column(table, column, declaration):
+    """Step that adds a column unless an older setup already added it"""
+    def step(cursor):
+        if not column_exists(cursor, table, column):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    return step
+
+
+def drop_column(table, column):
+    def step(cursor):
+        if column_exists(cursor, table, column):
+            cursor.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+    return step
+
+
+# ========== MIGRATIONS ==========
+MIGRATIONS = [
+    Migration(1, "create users and history", up=['''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            email TEXT,
+            phone TEXT,
+            password TEXT,
+            user_type TEXT DEFAULT 'farmer'
+        )
+    ''', '''
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            result TEXT,
+            confidence REAL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    '''], down=["DROP TABLE history", "DROP TABLE users"]),
+
+    # Databases from before user roles have users without user_type
+    Migration(2, "add users.user_type", up=[add_column("users", "user_type", "TEXT DEFAULT 'farmer'")],
+              down=[drop_column("users", "user_type")]),
+
+    Migration(3, "create detection_jobs", up=['''
+        CREATE TABLE IF NOT EXISTS detection_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            model_id TEXT,
+            status TEXT DEFAULT 'queued',
+            source TEXT,
+            result TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    '''], down=["DROP TABLE detection_jobs"]),
+
+    Migration(4, "add history.image_hash and history.predictions", up=[
+        add_column("history", "image_hash", "TEXT"),
+        add_column("history", "predictions", "TEXT"),
+    ], down=[
+        drop_column("history", "predictions"),
+        drop_column("history", "image_hash"),
+    ]),
+
+    Migration(5, "create ingest_runs and ingest_items", up=['''
+        CREATE TABLE IF NOT EXISTS ingest_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            archive_hash TEXT,
+            archive_name TEXT,
+            user_id INTEGER,
+            model_id TEXT,
+            total INTEGER,
+            status TEXT DEFAULT 'running',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''', '''
+        CREATE TABLE IF NOT EXISTS ingest_items (
+            run_id INTEGER,
+            entry_name TEXT,
+            status TEXT,
+            diagnosis TEXT,
+            confidence REAL,
+            image_hash TEXT,
+            error TEXT,
+            PRIMARY KEY (run_id, entry_name),
+            FOREIGN KEY (run_id) REFERENCES ingest_runs (id)
+        )
+    '''], down=["DROP TABLE ingest_items", "DROP TABLE ingest_runs"]),
+
+    Migration(6, "add history.duplicate_of and scan_hashes", up=[
+        add_column("history", "duplicate_of", "TEXT"),
+        '''
+        CREATE TABLE IF NOT EXISTS scan_hashes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dhash TEXT,
+            model_id TEXT,
+            image_hash TEXT,
+            result TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ], down=["DROP TABLE scan_hashes", drop_column("history", "duplicate_of")]),
+
+    # History, profile and recent activity filter by user and sort by date; OTP looks
+    # users up by email; login matches username and user_type
+    Migration(7, "index history, users and ingest lookups", up=[
+        "CREATE INDEX IF NOT EXISTS idx_history_user_created ON history (user_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_history_created ON history (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)",
+        "CREATE INDEX IF NOT EXISTS idx_users_username_type ON users (username, user_type)",
+        "CREATE INDEX IF NOT EXISTS idx_ingest_runs_archive ON ingest_runs (archive_hash, model_id)",
+    ], down=[
+        "DROP INDEX IF EXISTS idx_ingest_runs_archive",
+        "DROP INDEX IF EXISTS idx_users_username_type",
+        "DROP INDEX IF EXISTS idx_users_email",
+        "DROP INDEX IF EXISTS idx_history_created",
+        "DROP INDEX IF EXISTS idx_history_user_created",
+    ]),
+
+    # Profile totals maintained by triggers on history; see user_stats.py
+    Migration(8, "create user_stats with history triggers",
+              up=user_stats.TABLES + user_stats.TRIGGERS + [user_stats.rebuild_tables],
+              down=user_stats.DROP),
+
+    # Dashboard counters per day x disease x user type; see rollups.py
+    Migration(9, "create daily_detections rollup with history triggers",
+              up=rollups.TABLES + rollups.LOOKUP_TRIGGERS + [rollups.lookup_rebuild_tables],
+              down=rollups.DROP),
+
+    # Near-duplicate results are only reused between scans of the same user
+    Migration(10, "add scan_hashes.user_id", up=[add_column("scan_hashes", "user_id", "INTEGER")],
+              down=[drop_column("scan_hashes", "user_id")]),
+
+    # The rollup keys on the user type at save time; looking it up in users at delete
+    # time missed the row once an admin changed the user's role
+    Migration(11, "add history.user_type and key the rollup on it",
+              up=[
+                  add_column("history", "user_type", "TEXT"),
+                  "UPDATE history SET user_type = (SELECT user_type FROM users WHERE users.id = history.user_id)",
+              ] + rollups.DROP_TRIGGERS + rollups.TRIGGERS + [rollups.rebuild_tables],
+              down=rollups.DROP_TRIGGERS + rollups.LOOKUP_TRIGGERS + [
+                  drop_column("history", "user_type"),
+                  rollups.lookup_rebuild_tables,
+              ]),
+]
+
+
+# ========== RUNNER ==========
+def _ensure_version_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def applied_versions(db_path=database.DB_PATH):
+    conn = database.connect(db_path)
+    cursor = conn.cursor()
+    _ensure_version_table(cursor)
+    cursor.execute("SELECT version FROM schema_migrations")
+    versions = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+    conn.close()
+    return versions
+
+
+def _run_steps(cursor, steps):
+    for step in steps:
+        if callable(step):
+            step(cursor)
+        else:
+            cursor.execute(step)
+
+
+def _apply(db_path, migration, direction):
+    """Run one migration's steps and record it, all in one transaction
+
+    Returns False without running anything if another process got there first.
+    """
+    conn = database.connect(db_path)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        # Versions were read before taking the write lock; check again now that we hold it
+        cursor.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (migration.version,))
+        if (cursor.fetchone() is not None) == (direction == "up"):
+            conn.rollback()
+            return False
+        if direction == "up":
+            _run_steps(cursor, migration.up)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)",
+                           (migration.version, migration.name))
+        else:
+            _run_steps(cursor, migration.down)
+            cursor.execute("DELETE FROM schema_migrations WHERE version = ?", (migration.version,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    print(f"Migration {migration.version} {direction}: {migration.name}")
+    return True
+
+
+def migrate(db_path=database.DB_PATH, target=None):
+    """Apply pending migrations up to target (default: all); returns the versions applied"""
+    applied = applied_versions(db_path)
+    done = []
+    for migration in MIGRATIONS:
+        if migration.version in applied or (target is not None and migration.version > target):
+            continue
+        if _apply(db_path, migration, "up"):
+            done.append(migration.version)
+    return done
+
+
+def rollback(db_path=database.DB_PATH, target=0):
+    """Revert applied migrations newer than target, newest first; returns the versions reverted"""
+    applied = applied_versions(db_path)
+    done = []
+    for migration in reversed(MIGRATIONS):
+        if migration.version in applied and migration.version > target and _apply(db_path, migration, "down"):
+            done.append(migration.version)
+    return done
+
+
+_migrated = {}
+_migrated_lock = threading.Lock()
+
+
+def ensure_migrated(db_path=database.DB_PATH):
+    """Migrate a database once per process; later calls are a dictionary lookup
+
+    Returns how long the check and any migrations took, in milliseconds.
+    """
+    if db_path in _migrated:
+        return _migrated[db_path]
+    with _migrated_lock:
+        if db_path not in _migrated:
+            start = time.perf_counter()
+            migrate(db_path)
+            _migrated[db_path] = (time.perf_counter() - start) * 1000
+    return _migrated[db_path]
+
+
+# ========== ENTRY POINT ==========
+def main():
+    parser = argparse.ArgumentParser(description="Manage the Palay Protector database schema")
+    parser.add_argument("command", choices=["status", "up", "down"])
+    parser.add_argument("version", nargs="?", type=int, help="target version (required for down)")
+    parser.add_argument("--db", default=database.DB_PATH)
+    args = parser.parse_args()
+
+    if args.command == "up":
+        migrate(args.db, args.version)
+    elif args.command == "down":
+        if args.version is None:
+            parser.error("down needs a target version, e.g. 'down 6' (0 drops every table)")
+        rollback(args.db, args.version)
+
+    applied = applied_versions(args.db)
+    for migration in MIGRATIONS:
+        print(f"{'[x]' if migration.version in applied else '[ ]'} {migration.version:>3}  {migration.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Local stand-in for the Roboflow serverless API.
+
+Speaks the hosted v0 endpoint PooledInferenceClient uses (POST
+/<project>/<version>?api_key=... with a base64 image body) and returns canned
+predictions, with configurable latency, error rate and timeouts. It is not a
+stand-in for inference_sdk's InferenceHTTPClient, which treats a localhost URL as
+a self-hosted server and calls /model/registry and /model/add first.
+
+    python mock_inference_server.py --port 9001 --latency lognormal:0.8:0.4 --error-rate 0.05
+
+Point the app at it with PALAY_INFERENCE_BACKEND=mock (and PALAY_MOCK_API_URL
+if it is not on the default port).
+"""
+
+# ========== IMPORTS ==========
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# ========== CANNED PREDICTIONS ==========
+DISEASE_CLASSES = [
+    "Brown Spot",
+    "Sheath Blight",
+    "Bacterial Leaf Blight",
+    "Rice Hispa",
+    "False Smut",
+    "Leaf Smut",
+    "Leaf Scald",
+    "Narrow Brown Leaf Spot",
+    "Rice Blast",
+    "Rice Stripes",
+    "Rice Tungro",
+]
+
+
+def canned_predictions(image_bytes, healthy_rate=0.3, max_predictions=3):
+    """Deterministic fake predictions: the same image always gets the same answer"""
+    rng = random.Random(hashlib.sha256(image_bytes).digest())
+    if rng.random() < healthy_rate:
+        return []
+    predictions = []
+    for detection_id in range(rng.randint(1, max_predictions)):
+        class_id = rng.randrange(len(DISEASE_CLASSES))
+        predictions.append({
+            "x": rng.uniform(50, 590),
+            "y": rng.uniform(50, 430),
+            "width": rng.uniform(20, 200),
+            "height": rng.uniform(20, 200),
+            "confidence": round(rng.uniform(0.4, 0.99), 4),
+            "class": DISEASE_CLASSES[class_id],
+            "class_id": class_id,
+            "detection_id": f"mock-{detection_id}",
+        })
+    return predictions
+
+
+# ========== FAULT INJECTION ==========
+def parse_latency(spec):
+    """Turn 'fixed:0.5', 'uniform:0.2:1.5', 'normal:0.8:0.2' or 'lognormal:0.8:0.4' into a sampler (seconds)"""
+    kind, *params = spec.split(":")
+    params = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda rng: params[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        # params are the median and the sigma of the underlying normal
+        mu = math.log(params[0])
+        return lambda rng: rng.lognormvariate(mu, params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockConfig:
+    """Knobs shared by every request handler thread"""
+
+    def __init__(self, latency="fixed:0", error_rate=0.0, error_status=503, timeout_rate=0.0,
+                 timeout_seconds=120.0, healthy_rate=0.3, api_key=None, seed=None):
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.healthy_rate = healthy_rate
+        self.api_key = api_key
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "errors": 0, "timeouts": 0}
+
+    def draw(self):
+        """Pick (latency, outcome) for one request; outcome is 'ok', 'error' or 'timeout'"""
+        with self._lock:
+            self.counters["requests"] += 1
+            roll = self._rng.random()
+            latency = self.sample_latency(self._rng)
+            if roll < self.timeout_rate:
+                self.counters["timeouts"] += 1
+                return self.timeout_seconds, "timeout"
+            if roll < self.timeout_rate + self.error_rate:
+                self.counters["errors"] += 1
+                return latency, "error"
+            return latency, "ok"
+
+
+# ========== HTTP HANDLER ==========
+class MockInferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = MockConfig()
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/info":
+            self._send_json(200, {"name": "Palay Protector mock inference server", "version": "0.1"})
+        elif urlparse(self.path).path == "/stats":
+            self._send_json(200, self.config.counters)
+        else:
+            self._send_json(404, {"message": "Not found"})
+
+    def do_POST(self):
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        parts = [p for p in url.path.split("/") if p]
+        if len(parts) != 2:
+            self._send_json(404, {"message": "Expected /<project>/<version>"})
+            return
+        if self.config.api_key and parse_qs(url.query).get("api_key", [None])[0] != self.config.api_key:
+            self._send_json(403, {"message": "Invalid API key"})
+            return
+        try:
+            image_bytes = base64.b64decode(body, validate=False)
+        except (binascii.Error, ValueError):
+            self._send_json(400, {"message": "Body must be a base64 encoded image"})
+            return
+
+        latency, outcome = self.config.draw()
+        time.sleep(latency)
+        if outcome == "timeout":
+            # Upstream hung; drop the connection without a response
+            self.close_connection = True
+            return
+        if outcome == "error":
+            self._send_json(self.config.error_status, {"message": "Injected upstream error"})
+            return
+
+        self._send_json(200, {
+            "inference_id": hashlib.sha1(body).hexdigest(),
+            "time": time.perf_counter() - started,
+            "image": {"width": 640, "height": 480},
+            "predictions": canned_predictions(image_bytes, healthy_rate=self.config.healthy_rate),
+        })
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host="127.0.0.1", port=9001, config=None):
+    """Create (but do not start) a mock server; handy for tests and benchmarks"""
+    handler = type("ConfiguredMockHandler", (MockInferenceHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Roboflow inference API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", default="fixed:0",
+                        help="fixed:S | uniform:MIN:MAX | normal:MEAN:STD | lognormal:MEDIAN:SIGMA (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of requests that hang, then drop")
+    parser.add_argument("--timeout-seconds", type=float, default=120.0)
+    parser.add_argument("--healthy-rate", type=float, default=0.3, help="fraction of images with no predictions")
+    parser.add_argument("--api-key", default=None, help="reject requests without this api_key")
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible latency and faults")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        timeout_rate=args.timeout_rate,
+        timeout_seconds=args.timeout_seconds,
+        healthy_rate=args.healthy_rate,
+        api_key=args.api_key,
+        seed=args.seed,
+    )
+    server = make_server(args.host, args.port, config)
+    print(f"Mock inference server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
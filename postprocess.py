@@ -0,0 +1,179 @@
+# ========== IMPORTS ==========
+import json
+
+import numpy as np
+
+# ========== CONFIGURATION ==========
+NMS_IOU_THRESHOLD = 0.5
+# Predictions below this confidence are ignored for the diagnosis
+CONFIDENCE_THRESHOLD = 0.4
+# Column order of each prediction in a compact payload
+COMPACT_FIELDS = ["class", "confidence", "x", "y", "width", "height"]
+
+
+# ========== BOX HELPERS ==========
+def predictions_to_arrays(predictions):
+    """Split Roboflow predictions into (N, 4) corner boxes, scores and class names"""
+    if not predictions:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float64), np.array([], dtype=object)
+    centers = np.array([[p["x"], p["y"], p["width"], p["height"]] for p in predictions], dtype=np.float32)
+    boxes = np.column_stack([
+        centers[:, 0] - centers[:, 2] / 2,
+        centers[:, 1] - centers[:, 3] / 2,
+        centers[:, 0] + centers[:, 2] / 2,
+        centers[:, 1] + centers[:, 3] / 2,
+    ])
+    scores = np.array([p["confidence"] for p in predictions], dtype=np.float64)
+    classes = np.array([p["class"] for p in predictions], dtype=object)
+    return boxes, scores, classes
+
+
+def nms(boxes, scores, classes=None, iou_threshold=NMS_IOU_THRESHOLD):
+    """Vectorized non-max suppression; returns kept indices, best score first
+
+    With classes given, boxes only suppress boxes of the same class.
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if classes is not None:
+        # Shift each class into its own region so boxes of different classes never overlap
+        _, class_ids = np.unique(classes, return_inverse=True)
+        boxes = boxes + (class_ids * (boxes.max() + 1))[:, None]
+
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        width = np.clip(np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0]), 0, None)
+        height = np.clip(np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1]), 0, None)
+        overlap = width * height
+        iou = overlap / (areas[best] + areas[rest] - overlap + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+# ========== TILE MERGING ==========
+def merge_tile_predictions(tile_results, tiles, scale=1.0, iou_threshold=NMS_IOU_THRESHOLD):
+    """Map per-tile predictions back to image coordinates and drop duplicates from tile overlaps
+
+    tiles are (offset_x, offset_y) pairs matching tile_results; scale converts the
+    tiled image's pixels back to the original photo's pixels.
+    """
+    predictions = []
+    for result, (offset_x, offset_y) in zip(tile_results, tiles):
+        for pred in result.get("predictions") or []:
+            predictions.append({
+                **pred,
+                "x": (pred["x"] + offset_x) * scale,
+                "y": (pred["y"] + offset_y) * scale,
+                "width": pred["width"] * scale,
+                "height": pred["height"] * scale,
+            })
+    boxes, scores, classes = predictions_to_arrays(predictions)
+    return [predictions[i] for i in nms(boxes, scores, classes, iou_threshold)]
+
+
+# ========== DIAGNOSIS ==========
+def summarize(result, min_confidence=CONFIDENCE_THRESHOLD, iou_threshold=NMS_IOU_THRESHOLD):
+    """Reduce raw predictions to one diagnosis with per-class count, confidence and area
+
+    Returns {"diagnosis", "confidence" (%), "detections", "classes": [...]} where classes
+    are sorted by their best confidence. The diagnosis is "Healthy" when nothing passes
+    the threshold.
+    """
+    boxes, scores, classes = predictions_to_arrays(result.get("predictions") or [])
+    passed = scores >= min_confidence
+    boxes, scores, classes = boxes[passed], scores[passed], classes[passed]
+    kept = nms(boxes, scores, classes, iou_threshold)
+    boxes, scores, classes = boxes[kept], scores[kept], classes[kept]
+    if len(scores) == 0:
+        return {"diagnosis": "Healthy", "confidence": None, "detections": 0, "classes": []}
+
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    image = result.get("image") or {}
+    image_area = (image.get("width") or 0) * (image.get("height") or 0)
+
+    names, inverse, counts = np.unique(classes, return_inverse=True, return_counts=True)
+    max_confidence = np.zeros(len(names), dtype=np.float64)
+    np.maximum.at(max_confidence, inverse, scores)
+    mean_confidence = np.bincount(inverse, weights=scores, minlength=len(names)) / counts
+    total_area = np.bincount(inverse, weights=areas, minlength=len(names))
+
+    per_class = [
+        {
+            "class": str(names[i]),
+            "count": int(counts[i]),
+            "max_confidence": float(max_confidence[i]) * 100,
+            "mean_confidence": float(mean_confidence[i]) * 100,
+            "area": float(total_area[i]),
+            "area_fraction": float(total_area[i]) / image_area if image_area else None,
+        }
+        for i in np.argsort(-max_confidence)
+    ]
+    return {
+        "diagnosis": per_class[0]["class"],
+        "confidence": per_class[0]["max_confidence"],
+        "detections": int(len(scores)),
+        "classes": per_class,
+    }
+
+
+# ========== FIELD REPORT ==========
+def field_report(summaries):
+    """Combine per-frame (or per-photo) diagnoses into one report for a whole field"""
+    frames = len(summaries)
+    diseased = [summary for summary in summaries if summary["diagnosis"] != "Healthy"]
+    per_class = {}
+    for summary in diseased:
+        for entry in summary["classes"]:
+            stats = per_class.setdefault(entry["class"], {"class": entry["class"], "frames": 0, "detections": 0, "max_confidence": 0.0})
+            stats["frames"] += 1
+            stats["detections"] += entry["count"]
+            stats["max_confidence"] = max(stats["max_confidence"], entry["max_confidence"])
+    classes = sorted(per_class.values(), key=lambda c: (c["frames"], c["max_confidence"]), reverse=True)
+    for stats in classes:
+        stats["prevalence"] = stats["frames"] / frames if frames else 0.0
+    return {
+        "frames": frames,
+        "diseased_frames": len(diseased),
+        "diagnosis": classes[0]["class"] if classes else "Healthy",
+        "confidence": classes[0]["max_confidence"] if classes else None,
+        "classes": classes,
+    }
+
+
+# ========== STORAGE PAYLOAD ==========
+def compact_predictions(result, model_id=None, latency_ms=None):
+    """Serialize a raw result as compact JSON for history: one array per prediction
+
+    Keeps everything needed to recompute a diagnosis later (boxes, confidences,
+    image size) plus the model and inference latency.
+    """
+    image = result.get("image") or {}
+    payload = {
+        "model_id": model_id,
+        "latency_ms": round(latency_ms, 1) if latency_ms is not None else None,
+        "image": [image.get("width"), image.get("height")],
+        "fields": COMPACT_FIELDS,
+        "predictions": [
+            [p["class"], round(p["confidence"], 4), round(p["x"], 1), round(p["y"], 1),
+             round(p["width"], 1), round(p["height"], 1)]
+            for p in result.get("predictions") or []
+        ],
+    }
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def expand_predictions(payload):
+    """Turn a compact history payload back into a result dict that summarize() accepts"""
+    data = json.loads(payload)
+    width, height = data["image"]
+    return {
+        "model_id": data["model_id"],
+        "latency_ms": data["latency_ms"],
+        "image": {"width": width, "height": height},
+        "predictions": [dict(zip(data["fields"], values)) for values in data["predictions"]],
+    }
@@ -0,0 +1,184 @@
+# ========== IMPORTS ==========
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import database
+
+# ========== CONFIGURATION ==========
+CACHE_DB = os.environ.get("PALAY_CACHE_DB", "inference_cache.db")
+MEMORY_MAX_ENTRIES = int(os.environ.get("PALAY_CACHE_MEMORY_ENTRIES", "256"))
+DISK_MAX_BYTES = int(os.environ.get("PALAY_CACHE_DISK_BYTES", str(50 * 1024 * 1024)))
+TTL_SECONDS = int(os.environ.get("PALAY_CACHE_TTL", str(30 * 24 * 3600)))
+
+
+def make_key(image_bytes, model_id):
+    """Content-address an inference call by image hash and model"""
+    return f"{model_id}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+
+# ========== TWO-TIER CACHE ==========
+class InferenceCache:
+    """Inference results cached in a bounded in-memory LRU backed by SQLite"""
+
+    def __init__(self, db_path=CACHE_DB, memory_max_entries=MEMORY_MAX_ENTRIES,
+                 disk_max_bytes=DISK_MAX_BYTES, ttl=TTL_SECONDS):
+        self.db_path = db_path
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl = ttl
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expired": 0,
+        }
+
+        conn = database.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS inference_cache (
+                key TEXT PRIMARY KEY,
+                model_id TEXT,
+                result TEXT,
+                size_bytes INTEGER,
+                created_at REAL,
+                last_access REAL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_inference_cache_last_access ON inference_cache (last_access)")
+        conn.commit()
+        conn.close()
+
+    def get(self, key):
+        """Return (result, tier) for a cached key, or (None, None) on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                result, created_at = entry
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return result, "memory"
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+        conn = database.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT result, created_at FROM inference_cache WHERE key = ?", (key,))
+        row = cursor.fetchone()
+        if row and now - row[1] <= self.ttl:
+            cursor.execute("UPDATE inference_cache SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            conn.close()
+            result = json.loads(row[0])
+            with self._lock:
+                self._remember(key, result, row[1])
+                self._stats["disk_hits"] += 1
+            return result, "disk"
+
+        if row:
+            cursor.execute("DELETE FROM inference_cache WHERE key = ?", (key,))
+            conn.commit()
+        conn.close()
+        with self._lock:
+            if row:
+                self._stats["expired"] += 1
+            self._stats["misses"] += 1
+        return None, None
+
+    def put(self, key, model_id, result):
+        """Store a result in both tiers, evicting old entries past the limits"""
+        now = time.time()
+        payload = json.dumps(result, separators=(",", ":"))
+        with self._lock:
+            self._remember(key, result, now)
+
+        conn = database.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO inference_cache (key, model_id, result, size_bytes, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (key, model_id, payload, len(payload), now, now))
+        cursor.execute("DELETE FROM inference_cache WHERE created_at < ?", (now - self.ttl,))
+        expired = cursor.rowcount
+        evicted = self._evict_disk(cursor)
+        conn.commit()
+        conn.close()
+        with self._lock:
+            self._stats["expired"] += max(expired, 0)
+            self._stats["disk_evictions"] += evicted
+
+    def _remember(self, key, result, created_at):
+        self._memory[key] = (result, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def _evict_disk(self, cursor):
+        """Drop least recently used rows until the disk tier fits its byte budget"""
+        cursor.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM inference_cache")
+        excess = cursor.fetchone()[0] - self.disk_max_bytes
+        if excess <= 0:
+            return 0
+        cursor.execute("SELECT key, size_bytes FROM inference_cache ORDER BY last_access")
+        doomed = []
+        for key, size_bytes in cursor.fetchall():
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= size_bytes
+        cursor.executemany("DELETE FROM inference_cache WHERE key = ?", doomed)
+        return len(doomed)
+
+    def stats(self):
+        """Hit/miss/eviction counters for the admin dashboard"""
+        conn = database.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM inference_cache")
+        disk_entries, disk_bytes = cursor.fetchone()
+        conn.close()
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        stats["disk_entries"] = disk_entries
+        stats["disk_bytes"] = disk_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+# ========== SHARED INSTANCE ==========
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide inference cache, creating it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = InferenceCache()
+    return _cache
+
+
+def cached_infer(client, image_bytes, model_id):
+    """Run client.infer through the cache; returns (result, source)"""
+    cache = get_cache()
+    key = make_key(image_bytes, model_id)
+    result, tier = cache.get(key)
+    if result is not None:
+        return result, tier
+    result = client.infer(image_bytes, model_id=model_id)
+    cache.put(key, model_id, result)
+    return result, "remote"
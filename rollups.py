@@ -0,0 +1,183 @@
+"""Daily detection rollups for the admin dashboard.
+
+daily_detections holds one count per day x disease x user type, kept current by
+triggers on history. Dashboard counters sum a few hundred rollup rows by day
+instead of scanning history through DATE(created_at).
+
+The user type comes from history.user_type, stamped when the scan is saved
+(migration 11), so a later change of role cannot make a delete miss its row.
+
+    python rollups.py rebuild     # recompute the rollup from history (backfills, repairs)
+"""
+
+# ========== IMPORTS ==========
+import argparse
+import time
+
+import database
+
+# ========== SCHEMA ==========
+# Days are UTC dates, like the CURRENT_TIMESTAMP defaults in history
+TABLES = ['''
+    CREATE TABLE IF NOT EXISTS daily_detections (
+        day TEXT,
+        disease TEXT,
+        user_type TEXT,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, disease, user_type)
+    )
+''']
+
+# The rollup key is a function of the history row alone, so the delete trigger and
+# the rebuild always land on the row the insert trigger counted
+TRIGGERS = ['''
+    CREATE TRIGGER IF NOT EXISTS trg_history_daily_insert AFTER INSERT ON history
+    BEGIN
+        INSERT INTO daily_detections (day, disease, user_type, count)
+        VALUES (DATE(NEW.created_at), COALESCE(NEW.result, ''), COALESCE(NEW.user_type, 'farmer'), 1)
+        ON CONFLICT (day, disease, user_type) DO UPDATE SET count = count + 1;
+    END
+''', '''
+    CREATE TRIGGER IF NOT EXISTS trg_history_daily_delete AFTER DELETE ON history
+    BEGIN
+        UPDATE daily_detections SET count = count - 1
+        WHERE day = DATE(OLD.created_at)
+          AND disease = COALESCE(OLD.result, '')
+          AND user_type = COALESCE(OLD.user_type, 'farmer');
+        DELETE FROM daily_detections
+        WHERE day = DATE(OLD.created_at) AND disease = COALESCE(OLD.result, '')
+          AND user_type = COALESCE(OLD.user_type, 'farmer') AND count <= 0;
+    END
+''']
+
+DROP_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS trg_history_daily_delete",
+    "DROP TRIGGER IF EXISTS trg_history_daily_insert",
+]
+
+DROP = DROP_TRIGGERS + ["DROP TABLE IF EXISTS daily_detections"]
+
+
+# ========== REBUILD ==========
+def rebuild_tables(cursor):
+    """Recompute daily_detections from history with the given cursor"""
+    cursor.execute("DELETE FROM daily_detections")
+    cursor.execute("""
+        INSERT INTO daily_detections (day, disease, user_type, count)
+        SELECT DATE(created_at), COALESCE(result, ''), COALESCE(user_type, 'farmer'), COUNT(*)
+        FROM history
+        GROUP BY 1, 2, 3
+    """)
+
+
+def rebuild(db_path=database.DB_PATH):
+    """Recompute the rollup in one transaction; returns the number of rollup rows"""
+    conn = database.connect(db_path)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        rebuild_tables(cursor)
+        cursor.execute("SELECT COUNT(*) FROM daily_detections")
+        rows = cursor.fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return rows
+
+
+# ========== MIGRATION 9 SCHEMA ==========
+# Before history had user_type, the triggers looked the type up in users. Kept so
+# migration 9 (and rolling back past 11) still means what it did when released.
+_CURRENT_TYPE_OF_NEW = "(SELECT COALESCE(user_type, 'farmer') FROM users WHERE id = NEW.user_id)"
+_CURRENT_TYPE_OF_OLD = "(SELECT COALESCE(user_type, 'farmer') FROM users WHERE id = OLD.user_id)"
+
+LOOKUP_TRIGGERS = [f'''
+    CREATE TRIGGER IF NOT EXISTS trg_history_daily_insert AFTER INSERT ON history
+    BEGIN
+        INSERT INTO daily_detections (day, disease, user_type, count)
+        VALUES (DATE(NEW.created_at), COALESCE(NEW.result, ''), COALESCE({_CURRENT_TYPE_OF_NEW}, 'farmer'), 1)
+        ON CONFLICT (day, disease, user_type) DO UPDATE SET count = count + 1;
+    END
+''', f'''
+    CREATE TRIGGER IF NOT EXISTS trg_history_daily_delete AFTER DELETE ON history
+    BEGIN
+        UPDATE daily_detections SET count = count - 1
+        WHERE day = DATE(OLD.created_at)
+          AND disease = COALESCE(OLD.result, '')
+          AND user_type = COALESCE({_CURRENT_TYPE_OF_OLD}, 'farmer');
+        DELETE FROM daily_detections
+        WHERE day = DATE(OLD.created_at) AND disease = COALESCE(OLD.result, '') AND count <= 0;
+    END
+''']
+
+
+def lookup_rebuild_tables(cursor):
+    """Migration 9's backfill, reading each user's type from users"""
+    cursor.execute("DELETE FROM daily_detections")
+    cursor.execute("""
+        INSERT INTO daily_detections (day, disease, user_type, count)
+        SELECT DATE(h.created_at), COALESCE(h.result, ''), COALESCE(u.user_type, 'farmer'), COUNT(*)
+        FROM history h
+        LEFT JOIN users u ON u.id = h.user_id
+        GROUP BY 1, 2, 3
+    """)
+
+
+# ========== READS ==========
+def summary(db_path=database.DB_PATH, top=5):
+    """Detection counters for the dashboard: total, today, last 7 and 30 days, plus
+    the week's top diseases and the week's split by user type"""
+    conn = database.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT COALESCE(SUM(count), 0),
+               COALESCE(SUM(CASE WHEN day = DATE('now') THEN count END), 0),
+               COALESCE(SUM(CASE WHEN day >= DATE('now', '-7 days') THEN count END), 0),
+               COALESCE(SUM(CASE WHEN day >= DATE('now', '-30 days') THEN count END), 0)
+        FROM daily_detections
+    """)
+    total, today, week, month = cursor.fetchone()
+    cursor.execute("""
+        SELECT disease, SUM(count) AS detections
+        FROM daily_detections
+        WHERE day >= DATE('now', '-7 days') AND disease != ''
+        GROUP BY disease
+        ORDER BY detections DESC
+        LIMIT ?
+    """, (top,))
+    week_diseases = [{"disease": disease, "count": count} for disease, count in cursor.fetchall()]
+    cursor.execute("""
+        SELECT user_type, SUM(count)
+        FROM daily_detections
+        WHERE day >= DATE('now', '-7 days')
+        GROUP BY user_type
+    """)
+    week_by_user_type = dict(cursor.fetchall())
+    conn.close()
+    return {
+        "total": total,
+        "today": today,
+        "week": week,
+        "month": month,
+        "week_diseases": week_diseases,
+        "week_by_user_type": week_by_user_type,
+    }
+
+
+# ========== ENTRY POINT ==========
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the daily detection rollup")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--db", default=database.DB_PATH)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = rebuild(args.db)
+    print(f"Rebuilt {rows} rollup rows in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
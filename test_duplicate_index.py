@@ -0,0 +1,99 @@
+"""Near-duplicate reuse must never hand one leaf's diagnosis to a different leaf.
+
+    python -m pytest test_duplicate_index.py
+"""
+
+# ========== IMPORTS ==========
+import cv2
+import numpy as np
+import pytest
+
+import duplicate_index
+import image_pipeline
+import image_store
+import inference_client
+import migrations
+
+MODEL_ID = inference_client.MODEL_ID
+RESULT = {"predictions": [{"class": "Rice Blast", "confidence": 0.91}]}
+
+
+# ========== SYNTHETIC LEAVES ==========
+def leaf_photo(lesion_seed=None, lesions=0, size=(900, 1200)):
+    """The same veined leaf on a fixed background, with a seeded pattern of brown lesions"""
+    rng = np.random.default_rng(7)
+    height, width = size
+    image = (np.full((height, width, 3), (60, 110, 150), np.uint8) + rng.integers(0, 40, (height, width, 3))).astype(np.uint8)
+    cv2.ellipse(image, (width // 2, height // 2), (width // 3, height // 6), 20, 0, 360, (40, 160, 60), -1)
+    for _ in range(60):
+        x, y = (int(v) for v in rng.integers(0, (width, height)))
+        cv2.line(image, (x, y), (x + 60, y + 16), tuple(int(v) for v in rng.integers(0, 255, 3)), 4)
+    # Camera photos are smooth at pixel level; per-pixel noise would not survive re-encoding
+    image = cv2.GaussianBlur(image, (9, 9), 0)
+    lesion_rng = np.random.default_rng(lesion_seed)
+    for _ in range(lesions):
+        x = width // 2 + int(lesion_rng.integers(-width // 4, width // 4))
+        y = height // 2 + int(lesion_rng.integers(-height // 10, height // 10))
+        axes = (int(lesion_rng.integers(10, 30)), int(lesion_rng.integers(6, 14)))
+        cv2.ellipse(image, (x, y), axes, 20, 0, 360, (40, 90, 140), -1)
+    return image
+
+
+def jpeg(image, quality=92):
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def prepared(image, quality=92):
+    return image_pipeline.preprocess(jpeg(image, quality), MODEL_ID)[0]
+
+
+# ========== FIXTURES ==========
+@pytest.fixture
+def index(tmp_path):
+    db_path = str(tmp_path / "scans.db")
+    migrations.migrate(db_path)
+    return duplicate_index.DuplicateIndex(db_path, store=image_store.ImageStore(str(tmp_path / "images")))
+
+
+def add_scan(index, image_bytes, user_id, keep_photo=True):
+    digest = index.store.put(image_bytes) if keep_photo else image_store.content_hash(image_bytes)
+    index.add(image_pipeline.image_dhash(image_bytes), MODEL_ID, user_id, digest, RESULT)
+
+
+def lookup(index, image_bytes, user_id):
+    return index.lookup(image_pipeline.image_dhash(image_bytes), image_bytes, MODEL_ID, user_id)
+
+
+# ========== TESTS ==========
+def test_different_leaves_do_not_collide(index):
+    healthy = prepared(leaf_photo())
+    add_scan(index, healthy, user_id=1)
+    for lesion_seed in range(1, 6):
+        diseased = prepared(leaf_photo(lesion_seed, lesions=20))
+        assert lookup(index, diseased, user_id=1) is None
+    assert lookup(index, prepared(leaf_photo(1, lesions=1)), user_id=1) is None
+
+
+def test_different_lesion_patterns_do_not_collide(index):
+    add_scan(index, prepared(leaf_photo(1, lesions=12)), user_id=1)
+    for lesion_seed in range(2, 6):
+        assert lookup(index, prepared(leaf_photo(lesion_seed, lesions=12)), user_id=1) is None
+    # The dHash alone cannot tell these apart, so the confirmation step did the work
+    assert index.stats()["rejected"] > 0
+
+
+def test_reencoded_photo_is_reused_for_the_same_user_only(index):
+    photo = leaf_photo(1, lesions=12)
+    add_scan(index, prepared(photo), user_id=1)
+    recompressed = prepared(photo, quality=60)
+    match = lookup(index, recompressed, user_id=1)
+    assert match is not None and match[1] == RESULT
+    half_size = prepared(cv2.resize(photo, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA))
+    assert lookup(index, half_size, user_id=1) is not None
+    assert lookup(index, recompressed, user_id=2) is None
+
+
+def test_scan_without_a_kept_photo_is_not_reused(index):
+    photo = leaf_photo()
+    add_scan(index, prepared(photo), user_id=1, keep_photo=False)
+    assert lookup(index, prepared(photo, quality=60), user_id=1) is None
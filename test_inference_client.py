@@ -0,0 +1,67 @@
+"""The circuit breaker must recover once the upstream answers again, whatever it says.
+
+    python -m pytest test_inference_client.py
+"""
+
+# ========== IMPORTS ==========
+import pytest
+import requests
+
+import inference_client
+
+RESULT = {"predictions": []}
+
+
+# ========== SCRIPTED BACKEND ==========
+class ScriptedBackend(inference_client.InferenceBackend):
+    """Raises or returns the queued outcomes in order, then keeps returning RESULT"""
+
+    name = "scripted"
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def infer(self, inference_input, model_id=inference_client.MODEL_ID, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else RESULT
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def half_open_backend(probe_outcome):
+    """A resilient backend whose breaker has tripped and cooled down; the next call is the probe"""
+    backend = ScriptedBackend([requests.ConnectionError("down")] * 2 + [probe_outcome])
+    breaker = inference_client.CircuitBreaker(window=4, min_calls=2, error_rate=0.5, cooldown=0)
+    resilient = inference_client.ResilientBackend(backend, max_retries=0, breaker=breaker)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            resilient.infer(b"image")
+    assert breaker.state == "open"
+    return resilient
+
+
+# ========== TESTS ==========
+@pytest.mark.parametrize("probe_error", [
+    ValueError("not an image"),
+    requests.HTTPError("bad request", response=type("Response", (), {"status_code": 400})()),
+])
+def test_probe_with_bad_input_closes_the_breaker(probe_error):
+    resilient = half_open_backend(probe_error)
+    with pytest.raises(type(probe_error)):
+        resilient.infer(b"image")
+    assert resilient.breaker.state == "closed"
+    for _ in range(3):
+        assert resilient.infer(b"image") == RESULT
+    assert resilient.stats()["resilience"]["short_circuited"] == 0
+
+
+def test_probe_with_transient_error_reopens_the_breaker():
+    resilient = half_open_backend(requests.ConnectionError("still down"))
+    with pytest.raises(requests.ConnectionError):
+        resilient.infer(b"image")
+    assert resilient.breaker.state == "open"
+    # Cooldown is zero, so the next call probes again and succeeds
+    assert resilient.infer(b"image") == RESULT
+    assert resilient.breaker.state == "closed"
@@ -0,0 +1,160 @@
+"""Per-user scan statistics for the profile page.
+
+user_stats (totals, healthy/detected counts, last scan) and user_disease_counts
+are kept current by triggers on history, created in migration 8, so reading a
+profile costs two primary-key lookups however long the history is.
+
+    python user_stats.py rebuild     # recompute both tables from history (backfills, repairs)
+"""
+
+# ========== IMPORTS ==========
+import argparse
+import time
+
+import database
+
+# ========== SCHEMA ==========
+TABLES = ['''
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id INTEGER PRIMARY KEY,
+        total_scans INTEGER NOT NULL DEFAULT 0,
+        healthy_count INTEGER NOT NULL DEFAULT 0,
+        detected_count INTEGER NOT NULL DEFAULT 0,
+        last_scan_at TIMESTAMP
+    )
+''', '''
+    CREATE TABLE IF NOT EXISTS user_disease_counts (
+        user_id INTEGER,
+        disease TEXT,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, disease)
+    )
+''']
+
+TRIGGERS = ['''
+    CREATE TRIGGER IF NOT EXISTS trg_history_user_stats_insert AFTER INSERT ON history
+    BEGIN
+        INSERT INTO user_stats (user_id, total_scans, healthy_count, detected_count, last_scan_at)
+        VALUES (
+            NEW.user_id, 1,
+            CASE WHEN NEW.result = 'Healthy' THEN 1 ELSE 0 END,
+            CASE WHEN NEW.result != 'Healthy' THEN 1 ELSE 0 END,
+            NEW.created_at
+        )
+        ON CONFLICT (user_id) DO UPDATE SET
+            total_scans = total_scans + 1,
+            healthy_count = healthy_count + excluded.healthy_count,
+            detected_count = detected_count + excluded.detected_count,
+            last_scan_at = MAX(COALESCE(last_scan_at, excluded.last_scan_at), excluded.last_scan_at);
+        INSERT INTO user_disease_counts (user_id, disease, count)
+        SELECT NEW.user_id, NEW.result, 1
+        WHERE NEW.result IS NOT NULL AND NEW.result != 'Healthy'
+        ON CONFLICT (user_id, disease) DO UPDATE SET count = count + 1;
+    END
+''', '''
+    CREATE TRIGGER IF NOT EXISTS trg_history_user_stats_delete AFTER DELETE ON history
+    BEGIN
+        UPDATE user_stats SET
+            total_scans = total_scans - 1,
+            healthy_count = healthy_count - (CASE WHEN OLD.result = 'Healthy' THEN 1 ELSE 0 END),
+            detected_count = detected_count - (CASE WHEN OLD.result != 'Healthy' THEN 1 ELSE 0 END),
+            last_scan_at = (SELECT MAX(created_at) FROM history WHERE user_id = OLD.user_id)
+        WHERE user_id = OLD.user_id;
+        UPDATE user_disease_counts SET count = count - 1
+        WHERE user_id = OLD.user_id AND disease = OLD.result;
+        DELETE FROM user_disease_counts WHERE user_id = OLD.user_id AND disease = OLD.result AND count <= 0;
+    END
+''']
+
+DROP = [
+    "DROP TRIGGER IF EXISTS trg_history_user_stats_delete",
+    "DROP TRIGGER IF EXISTS trg_history_user_stats_insert",
+    "DROP TABLE IF EXISTS user_disease_counts",
+    "DROP TABLE IF EXISTS user_stats",
+]
+
+
+# ========== REBUILD ==========
+def rebuild_tables(cursor):
+    """Recompute user_stats and user_disease_counts from history with the given cursor"""
+    cursor.execute("DELETE FROM user_stats")
+    cursor.execute("DELETE FROM user_disease_counts")
+    cursor.execute("""
+        INSERT INTO user_stats (user_id, total_scans, healthy_count, detected_count, last_scan_at)
+        SELECT user_id,
+               COUNT(*),
+               SUM(CASE WHEN result = 'Healthy' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN result != 'Healthy' THEN 1 ELSE 0 END),
+               MAX(created_at)
+        FROM history
+        GROUP BY user_id
+    """)
+    cursor.execute("""
+        INSERT INTO user_disease_counts (user_id, disease, count)
+        SELECT user_id, result, COUNT(*)
+        FROM history
+        WHERE result IS NOT NULL AND result != 'Healthy'
+        GROUP BY user_id, result
+    """)
+
+
+def rebuild(db_path=database.DB_PATH):
+    """Recompute the stats tables in one transaction; returns the number of users"""
+    conn = database.connect(db_path)
+    cursor = conn.cursor()
+    try:
+        # IMMEDIATE blocks other writers so no history row slips in between the two steps
+        cursor.execute("BEGIN IMMEDIATE")
+        rebuild_tables(cursor)
+        cursor.execute("SELECT COUNT(*) FROM user_stats")
+        users = cursor.fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return users
+
+
+# ========== READS ==========
+def get_user_stats(user_id, db_path=database.DB_PATH):
+    """Totals, last scan and per-disease counts (most frequent first) for one user"""
+    conn = database.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT total_scans, healthy_count, detected_count, last_scan_at
+        FROM user_stats WHERE user_id = ?
+    """, (user_id,))
+    row = cursor.fetchone()
+    cursor.execute("""
+        SELECT disease, count FROM user_disease_counts
+        WHERE user_id = ? ORDER BY count DESC, disease
+    """, (user_id,))
+    diseases = cursor.fetchall()
+    conn.close()
+
+    total_scans, healthy_count, detected_count, last_scan_at = row or (0, 0, 0, None)
+    return {
+        "total_scans": total_scans,
+        "healthy_count": healthy_count,
+        "detected_count": detected_count,
+        "last_scan_at": last_scan_at,
+        "diseases": [{"disease": disease, "count": count} for disease, count in diseases],
+    }
+
+
+# ========== ENTRY POINT ==========
+def main():
+    parser = argparse.ArgumentParser(description="Maintain per-user scan statistics")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--db", default=database.DB_PATH)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    users = rebuild(args.db)
+    print(f"Rebuilt statistics for {users} users in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()